@@ -28,8 +28,9 @@ def _parse_args():
     """parse args from cli.
 
     You can mock this function for unittest.
+    The unknown args are ignored, they are for other entry point, ex: app.manage.
     """
-    args = parser.parse_args()
+    args, _ = parser.parse_known_args()
     return args
 
 def load_config():
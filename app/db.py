@@ -6,20 +6,215 @@ import pymongo
 from werkzeug.local import LocalProxy
 from app.config import config
 
+try:
+    from pymongo.monitoring import ConnectionPoolListener
+except ImportError:
+    # pymongo < 3.9, see `_inspect_pool`.
+    ConnectionPoolListener = None
+
+
+# config key: option of MongoClient, only the keys set in config are passed.
+CLIENT_OPTIONS = (
+    ('DB_MAX_POOL_SIZE', 'maxPoolSize'),
+    ('DB_MIN_POOL_SIZE', 'minPoolSize'),
+    ('DB_MAX_IDLE_TIME_MS', 'maxIdleTimeMS'),
+    ('DB_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS'),
+    ('DB_WAIT_QUEUE_MULTIPLE', 'waitQueueMultiple'),
+    ('DB_CONNECT_TIMEOUT_MS', 'connectTimeoutMS'),
+    ('DB_SOCKET_TIMEOUT_MS', 'socketTimeoutMS'),
+    ('DB_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS'),
+    # pymongo >= 3.6, ex: 'zlib'
+    ('DB_COMPRESSORS', 'compressors'),
+    ('DB_READ_PREFERENCE', 'readPreference'),
+    ('DB_READ_CONCERN_LEVEL', 'readConcernLevel'),
+    ('DB_W', 'w'),
+    ('DB_WTIMEOUT_MS', 'wtimeout'),
+    ('DB_JOURNAL', 'j'),
+)
 
 _db = None
 _client = None
+# the process which the clients are created in.
+_pid = None
+# the clients of `DB_CLIENTS` by name, (client, db, pool counter)
+_named = {}
+_counter = None
+# changed whenever the clients are created again, see `generation`.
+_generation = 0
+
+
+class _PoolCounter(ConnectionPoolListener or object):
+    """Count the events of connection pool, see `pool_stats`."""
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.check_out_failed = 0
+
+    def stats(self):
+        return {
+            'created': self.created,
+            'closed': self.closed,
+            'checked_out': self.checked_out,
+            'waiting': self.waiting,
+            'check_out_failed': self.check_out_failed,
+        }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_check_out_started(self, event):
+        self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        self.waiting -= 1
+        self.check_out_failed += 1
+
+    def connection_checked_out(self, event):
+        self.waiting -= 1
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+
+def client_options(overrides=None):
+    """Options of MongoClient from config.
+
+    :param dict overrides: config keys override the config, ex: one of `DB_CLIENTS`.
+    """
+    conf = dict(config)
+    conf.update(overrides or {})
+    options = {}
+    for key, option in CLIENT_OPTIONS:
+        if conf.get(key) is not None:
+            options[option] = conf[key]
+    return options
+
+
+def _connect(overrides=None):
+    """Create a client by config, return (client, db, pool counter)."""
+    options = client_options(overrides)
+    counter = None
+    if ConnectionPoolListener is not None:
+        counter = _PoolCounter()
+        options['event_listeners'] = [counter]
+    client = pymongo.MongoClient(config['DB_HOST'], config['DB_PORT'], **options)
+    return client, client[config['DB_NAME']], counter
+
 
 def _init_db():
-    client = pymongo.MongoClient(config['DB_HOST'], config['DB_PORT'])
-    db = client[config['DB_NAME']]
+    global _counter
+    client, db, _counter = _connect()
     return client, db
 
 
 def find_db():
-    global _client, _db
-    if not _db:
+    global _client, _db, _pid, _generation
+    if _db is None or _pid != os.getpid():
+        # a forked process must not use the sockets of the parent, connect again.
+        _named.clear()
         _client, _db = _init_db()
+        _pid = os.getpid()
+        _generation += 1
     return _db
 
+
+def generation():
+    """A number changed whenever the clients are created again, ex: after `reset()` or fork.
+
+    The collections of the old clients should not be used, see `Base._collection`.
+    """
+    if _db is None or _pid != os.getpid():
+        find_db()
+    return _generation
+
+
+def get_db(name=None):
+    """Return the db of a client in `DB_CLIENTS` by name, or the default one if it is not configured.
+
+    .. code-block:: python
+
+        'DB_CLIENTS': {
+            # bulk jobs, wait longer and do not wait for journal.
+            'bulk': {'DB_SOCKET_TIMEOUT_MS': 600000, 'DB_JOURNAL': False},
+        }
+    """
+    default = find_db()
+    overrides = config.get('DB_CLIENTS', {}).get(name)
+    if overrides is None:
+        return default
+    if name not in _named:
+        _named[name] = _connect(overrides)
+    return _named[name][1]
+
+
+def _inspect_pool(client):
+    """Read the pool of each server from pymongo internals, for pymongo without pool events."""
+    stats = {}
+    topology = getattr(client, '_topology', None)
+    for address, server in getattr(topology, '_servers', {}).items():
+        pool = getattr(server, 'pool', None)
+        semaphore = getattr(pool, '_socket_semaphore', None)
+        semaphore = getattr(semaphore, 'semaphore', semaphore)
+        max_size = getattr(client, 'max_pool_size', None)
+        available = getattr(semaphore, 'counter', None)
+        waiters = getattr(getattr(semaphore, '_cond', None), '_Condition__waiters', None)
+        stats['%s:%s' % address] = {
+            'idle': len(getattr(pool, 'sockets', ())),
+            'checked_out': max_size - available if max_size is not None and available is not None else None,
+            'waiting': len(waiters) if waiters is not None else None,
+        }
+    return stats
+
+
+def pool_stats():
+    """Utilization of the connection pool of each client, by name, 'default' for `db`."""
+    clients = [('default', _client, _counter)]
+    clients.extend((name, client, counter) for name, (client, _, counter) in sorted(_named.items()))
+
+    stats = {}
+    for name, client, counter in clients:
+        if client is None:
+            continue
+        row = {'max_pool_size': getattr(client, 'max_pool_size', None)}
+        if counter is not None:
+            row.update(counter.stats())
+        else:
+            row['servers'] = _inspect_pool(client)
+        stats[name] = row
+    return stats
+
+
+def reset():
+    """Close the clients, and connect again by next `find_db()`, ex: before fork."""
+    global _client, _db, _pid, _counter
+    if _pid == os.getpid():
+        if _client is not None:
+            _client.close()
+        for client, _, _ in _named.values():
+            client.close()
+    _named.clear()
+    _client = None
+    _db = None
+    _pid = None
+    _counter = None
+
 db = LocalProxy(find_db)
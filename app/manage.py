@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Maintenance commands run outside the web process.
+
+    python -m app.manage ensure_indexes --config default
+    python -m app.manage backfill --config default
+"""
+
+import argparse
+import json
+
+import app.config as config
+from app.logger import logger
+
+
+parser = argparse.ArgumentParser(
+    description='maintenance commands'
+)
+
+parser.add_argument(
+    'command',
+    choices=('ensure_indexes', 'backfill'),
+    help='command to run'
+)
+
+parser.add_argument(
+    '--config', '-f',
+    help='load custom config in configs',
+    default='default'
+)
+
+
+def ensure_indexes():
+    """Create the missing indexes declared on models."""
+    from app.models.orm import ensure_indexes
+    import app.models.models
+
+    created = ensure_indexes()
+    logger.info('created indexes: %s', json.dumps(created))
+    return created
+
+
+def backfill():
+    """Derive the fields of saved documents again, ex: the search keys after `SearchField` is declared."""
+    from app.models.orm import Meta
+    import app.models.models
+
+    for name, model in sorted(Meta.registry.items()):
+        if model._prepare_fields:
+            result = model.backfill()
+            logger.info('backfill `%s`: %d updated, %d errors', name, result.modified_count, len(result.errors))
+
+
+def main():
+    args = parser.parse_args()
+    config.load_config()
+    if args.command == 'ensure_indexes':
+        ensure_indexes()
+    elif args.command == 'backfill':
+        backfill()
+
+
+if __name__ == '__main__':
+    main()
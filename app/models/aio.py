@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Run the queries of models concurrently in greenlets.
+
+`Model.aio` has the same queries as the model, but each one returns a
+greenlet at once, and `.get()` of the greenlet waits for the result:
+
+.. code-block:: python
+
+    person = Person.aio.get_one(_id).get()
+    groups, relations = aio.gather(
+        Group.aio.get_many(person.groups),
+        aio.spawn(person.get_relations, fields=['name']),
+    )
+    for person in Person.aio.fetch({'groups': group_id}):
+        ...  # the next persons are loaded meanwhile
+
+The greenlets see the flask request of the caller, so they share its identity map.
+pymongo only waits for mongodb concurrently if gevent monkey patched the socket,
+otherwise the queries still work but run one by one.
+"""
+
+import functools
+
+import gevent
+from gevent.queue import Queue
+from flask import _app_ctx_stack, _request_ctx_stack
+
+
+def _bind_context(func):
+    """Run func with the flask app and request context of the caller."""
+    app_ctx = _app_ctx_stack.top
+    req_ctx = _request_ctx_stack.top
+
+    @functools.wraps(func)
+    def wrapper(*args, **kw):
+        # push the contexts directly, `ctx.push()` would run the teardown of request on pop.
+        if app_ctx is not None:
+            _app_ctx_stack.push(app_ctx)
+        if req_ctx is not None:
+            _request_ctx_stack.push(req_ctx)
+        try:
+            return func(*args, **kw)
+        finally:
+            if req_ctx is not None:
+                _request_ctx_stack.pop()
+            if app_ctx is not None:
+                _app_ctx_stack.pop()
+    return wrapper
+
+
+def spawn(func, *args, **kw):
+    """Call func in a new greenlet, `.get()` of the greenlet returns the result or raises the error."""
+    return gevent.spawn(_bind_context(func), *args, **kw)
+
+
+def gather(*greenlets, **kw):
+    """Wait for greenlets, return their results in order, or raise the first error.
+
+    :param float timeout: seconds, the unfinished greenlets are killed and `gevent.Timeout` is raised.
+    """
+    timeout = kw.get('timeout')
+    gevent.joinall(greenlets, timeout=timeout)
+    pending = [greenlet for greenlet in greenlets if not greenlet.ready()]
+    if pending:
+        gevent.killall(pending)
+        raise gevent.Timeout(timeout)
+    return [greenlet.get() for greenlet in greenlets]
+
+
+class AsyncFetchResult(object):
+    """Iterate a `FetchResult`, and the next instances are loaded in another greenlet meanwhile.
+
+    The loading starts when the iteration starts, and stops when it ends, even by
+    break or an error, so a result never iterated holds nothing.
+    """
+    _done = object()
+
+    def __init__(self, result, prefetch=200):
+        """
+        :param FetchResult result:
+        :param int prefetch: max instances loaded but not iterated yet.
+        """
+        self.result = result
+        self._queue = Queue(maxsize=prefetch)
+        self._greenlet = None
+
+    def _produce(self):
+        try:
+            for instance in self.result:
+                self._queue.put(instance)
+        except gevent.GreenletExit:
+            # killed by `close`, nobody waits for the rest.
+            return
+        except Exception:
+            self._queue.put(self._done)
+            raise
+        self._queue.put(self._done)
+
+    def __iter__(self):
+        if self._greenlet is not None:
+            raise RuntimeError('`AsyncFetchResult` can only be iterated once.')
+        self._greenlet = spawn(self._produce)
+        try:
+            while True:
+                instance = self._queue.get()
+                if instance is self._done:
+                    # raise the error of loading if any.
+                    self._greenlet.get()
+                    return
+                yield instance
+        finally:
+            # stopped early by break or an error, do not keep the cursor and the request.
+            self.close()
+
+    def close(self):
+        """Stop loading, if the rest are not iterated."""
+        if self._greenlet is not None:
+            self._greenlet.kill()
+
+
+class AsyncModel(object):
+    """The queries of a model in greenlets, see `Base.aio`."""
+
+    def __init__(self, model=None):
+        self.model = model
+
+    def __get__(self, instance, cls):
+        return AsyncModel(cls)
+
+    def get_one(self, _id=None, raw=None, fields=None):
+        return spawn(self.model.get_one, _id, raw=raw, fields=fields)
+
+    def get_many(self, ids, fields=None, chunk_size=500):
+        return spawn(self.model.get_many, ids, fields=fields, chunk_size=chunk_size)
+
+    def count(self, query={}, max_time_ms=1000):
+        return spawn(self.model.count, query, max_time_ms=max_time_ms)
+
+    def search(self, term, limit=20, fields=None):
+        return spawn(self.model.search, term, limit, fields=fields)
+
+    def fetch(self, query={}, fields=None, prefetch=200):
+        """Return an `AsyncFetchResult`, it loads the next instances while iterating."""
+        return AsyncFetchResult(self.model.fetch(query, fields=fields), prefetch=prefetch)
+
+    def save(self, instance, allow_fields=None):
+        return spawn(instance.save, allow_fields)
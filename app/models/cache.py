@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """A small thread-safe LRU cache, and each item is expired after `ttl` seconds.
+
+    .. code-block:: python
+
+        cache = LRUCache(maxsize=1000, ttl=60)
+        cache.set('key', 'value')
+        cache.get('key')  # 'value'
+        cache.stats()     # {'size': 1, 'hits': 1, 'misses': 0, ...}
+    """
+    _missing = object()
+
+    def __init__(self, maxsize=128, ttl=None):
+        """
+        :param int maxsize: the least recently used item is evicted when full.
+        :param float ttl: seconds, None for never expired.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, self._missing)
+            if item is self._missing or (item[1] is not None and item[1] < time.time()):
+                self.misses += 1
+                return default
+            # move to the end as the most recently used.
+            self._items[key] = item
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        expire = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expire)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            if self._items.pop(key, self._missing) is not self._missing:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            if self._items:
+                self.invalidations += len(self._items)
+                self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
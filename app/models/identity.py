@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Identity map of model instances in a flask request.
+
+In a request, `Base.get_one(_id)` returns the same instance for the same `_id`,
+so a document is loaded once, and every change is seen by all code of the request.
+
+Nothing is saved implicitly. `Base.save_later()` schedules an instance, and the
+scheduled ones are saved after the view returns a successful response, an error
+of saving is the error of the request.
+"""
+
+from collections import OrderedDict
+
+from flask import _request_ctx_stack
+
+
+def _identity_map(create=False):
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        return None
+    identity_map = getattr(ctx, 'model_identity_map', None)
+    if identity_map is None and create:
+        identity_map = ctx.model_identity_map = {}
+    return identity_map
+
+
+def current():
+    """The identity map of current request, for the callers loading many rows to look it up once.
+
+    It is an empty dict out of a request, then nothing is kept.
+    """
+    identity_map = _identity_map(create=True)
+    return {} if identity_map is None else identity_map
+
+
+def get(cls, _id):
+    """Return the instance of `cls` by `_id` in current request, or None."""
+    identity_map = _identity_map()
+    if identity_map:
+        return identity_map.get((cls, _id))
+    return None
+
+
+def add(instance):
+    """Keep the instance in current request, return the instance already kept if any."""
+    identity_map = _identity_map(create=True)
+    if identity_map is None:
+        return instance
+    return identity_map.setdefault((type(instance), instance.get_id()), instance)
+
+
+def discard(cls, _id):
+    identity_map = _identity_map()
+    if identity_map:
+        identity_map.pop((cls, _id), None)
+
+
+def save_later(instance, allow_fields=None):
+    """Save the instance after the view of current request returns, or at once out of a request.
+
+    :param list allow_fields: like `Base.save`, all changed fields if None.
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        return instance.save(allow_fields)
+    pending = getattr(ctx, 'model_pending_saves', None)
+    if pending is None:
+        pending = ctx.model_pending_saves = OrderedDict()
+    key = id(instance)
+    if key in pending:
+        _, scheduled = pending[key]
+        if scheduled is None or allow_fields is None:
+            allow_fields = None
+        else:
+            allow_fields = list(scheduled) + [k for k in allow_fields if k not in scheduled]
+    pending[key] = (instance, allow_fields)
+    return True
+
+
+def flush():
+    """Save the instances scheduled by `save_later` in current request."""
+    ctx = _request_ctx_stack.top
+    pending = getattr(ctx, 'model_pending_saves', None)
+    while pending:
+        _, (instance, allow_fields) = pending.popitem(last=False)
+        instance.save(allow_fields)
+
+
+def init_identity_map(app):
+    @app.after_request
+    def flush_pending_saves(response):
+        if response.status_code < 400:
+            flush()
+        return response
+
+    @app.teardown_request
+    def clear_identity_map(exc):
+        ctx = _request_ctx_stack.top
+        if ctx is not None:
+            ctx.model_identity_map = None
+            ctx.model_pending_saves = None
@@ -3,24 +3,31 @@ from collections import namedtuple
 import app.error as error
 
 from passlib.hash import pbkdf2_sha256
+from pymongo import UpdateOne
 
-from app.db import db
-from . import Base
-from . import IDField, StringField, DateField, BoolField, ListField, TupleField
+from . import Base, LRUCache
+from . import identity
+from . import IDField, StringField, DateField, BoolField, ListField, TupleField, SearchField
 
 
 class Admin(Base):
     _table = 'admins'
     _primary_key = 'admin_id'
+    # loaded on every authenticated request by `load_user`.
+    _cache = LRUCache(maxsize=256, ttl=60)
 
     admin_id = IDField(raw_field_key='_id')
     enabled = BoolField()
 
     @classmethod
     def login(cls, _id, password):
-        raw = db[cls._table].find_one({'_id': _id}, {'_id': 1, 'password': 1, 'enabled': 1})
+        raw = cls._collection().find_one({'_id': _id}, dict(cls._projection(), password=True))
         if raw and raw.get('enabled', False):
-            return cls.valid_password(password, raw['password'])
+            encoded = raw.pop('password')
+            if cls.valid_password(password, encoded):
+                # keep it in identity map, then load_user of this request do not query again.
+                cls.get_one(raw=raw)
+                return True
         return False
 
     @classmethod
@@ -36,9 +43,10 @@ class Admin(Base):
         return pbkdf2_sha256.verify(password, encoded)
 
     def update_password(self, password):
-        result = db[self._table].update_one({'_id': self.get_id()}, {
+        result = self._collection().update_one({'_id': self.get_id()}, {
             '$set': {'password': self.hash_password(password)}
         })
+        self._invalidate([self.get_id()])
         if result.matched_count:
             return True
         raise error.InvalidError('update password fail')
@@ -50,11 +58,11 @@ class Person(Base):
 
     person_id = IDField(raw_field_key='_id')
     social_id = StringField()
-    name = StringField()
-    birthday = DateField()
+    name = StringField(index=True)
+    birthday = DateField(month_day=True)
     gender = StringField()
 
-    phone_0 = StringField()
+    phone_0 = StringField(index=True)
     phone_1 = StringField()
     phone_2 = StringField()
 
@@ -67,49 +75,202 @@ class Person(Base):
     education = StringField()
     job = StringField()
 
-    register_date = DateField()
+    register_date = DateField(month_day=True)
     unregister_date = DateField()
 
-    baptize_date = DateField()
+    baptize_date = DateField(month_day=True)
     baptize_priest = StringField()
 
     gifts = ListField()     # ['aa', 'bb', 'cc']
-    groups = ListField()    # [group_id, group_id, group_id]
-    events = ListField()    # {date:'', 'title': 'bala...'}
-    relations = ListField()  # {rel: 'parent', person_id: '1231212'}
+    groups = ListField(index=True)    # [group_id, group_id, group_id]
+    events = ListField(incremental=True)    # {date:'', 'title': 'bala...'}
+    relations = ListField(incremental=True)  # {rel: 'parent', person_id: '1231212'}
     #TupleField(namedtuple('Relation', ('rel', 'person_id')), {'rel':None, 'person_id':None})
 
     note = StringField()
 
-    def get_relations(self):
-        rows = {row['_id']: row for row in self.relations}
-        persons, total = Person.fetch({'_id': {'$in': rows.keys()}})
-        for p in persons:
-            if p._id in rows:
-                rows[p._id]['person'] = p
-        return rows.values()
-        # return Person.fetch({'_id': {'$in': _ids}})
+    search_keys = SearchField('name')
+
+    _indexes = [
+        # for `Person.search`, the matches are sorted by name.
+        {'keys': [('search_keys', 1), ('name', 1)]},
+    ]
+
+    # the ceiling of `relation_graph`.
+    MAX_GRAPH_DEPTH = 5
+    MAX_GRAPH_NODES = 500
+
+    def get_relations(self, fields=None):
+        """Return relations with the related `person` loaded by one query.
+
+        .. code-block:: python
+
+            [{'rel': 'family', 'person_id': '1231212', 'person': <Person>}, ...]
+
+        `person` is None if it is not existed.
+        """
+        rows = [dict(row) for row in self.relations]
+        persons = Person.get_many([row['person_id'] for row in rows], fields=fields)
+        for row, person in zip(rows, persons):
+            row['person'] = person
+        return rows
+
+    def relation_graph(self, depth=2, max_nodes=200):
+        """Walk the relations in multi-hop, breadth first by one query of `get_many` for each hop.
+
+        .. code-block:: python
+
+            {
+                'root': '1231212',
+                'nodes': [{'person_id': '1231212', 'name': 'Bill', 'depth': 0}, ...],
+                'edges': [{'from': '1231212', 'to': '4564565', 'rel': 'family'}, ...],
+                'truncated': False,
+            }
+
+        The walk stops as soon as `max_nodes` persons are loaded, so the work is
+        bounded by it instead of the size of the connected network.
+
+        :param int depth: hops from this person, limited by `MAX_GRAPH_DEPTH`.
+        :param int max_nodes: max related persons, the nearest are kept, limited by `MAX_GRAPH_NODES`.
+        """
+        depth = max(1, min(int(depth), self.MAX_GRAPH_DEPTH))
+        max_nodes = max(1, min(int(max_nodes), self.MAX_GRAPH_NODES))
+        root_id = self.get_id()
+
+        def next_ids(frontier, seen):
+            ids = set(row.get('person_id') for person_id in frontier for row in relations[person_id])
+            ids.discard(None)
+            return sorted(ids - seen)
+
+        nodes = [{'person_id': root_id, 'name': self.name, 'depth': 0}]
+        relations = {root_id: self.relations}
+        frontier = [root_id]
+        truncated = False
+        for level in xrange(1, depth + 1):
+            ids = next_ids(frontier, set(relations))
+            frontier = []
+            pos = 0
+            # only load the persons which may fit, each chunk is the room left.
+            while pos < len(ids) and len(nodes) <= max_nodes:
+                chunk = ids[pos:pos + max_nodes + 1 - len(nodes)]
+                pos += len(chunk)
+                for person in Person.get_many(chunk, fields=['name', 'relations']):
+                    if person is None:
+                        continue
+                    nodes.append({'person_id': person.get_id(), 'name': person.name, 'depth': level})
+                    relations[person.get_id()] = person.relations
+                    frontier.append(person.get_id())
+
+            if len(nodes) > max_nodes:
+                rest = ids[pos:]
+                if level < depth:
+                    rest += next_ids(frontier, set(relations) | set(rest))
+                truncated = bool(rest) and self._collection().find_one({'_id': {'$in': rest}}, ['_id']) is not None
+                break
+            if not frontier:
+                break
+
+        edges = []
+        for person_id, rows in relations.iteritems():
+            for row in rows:
+                if row.get('person_id') in relations:
+                    edges.append({'from': person_id, 'to': row['person_id'], 'rel': row.get('rel')})
+
+        return {
+            'root': root_id,
+            'nodes': nodes,
+            'edges': edges,
+            'truncated': truncated,
+        }
+
+    @classmethod
+    def add_relation(cls, person_id, rel, other_person_id, due=False):
+        """Push a relation without loading persons, in one `bulk_write`.
+
+        The relation is only pushed if there is no relation to the same person,
+        and it is checked by the filter atomically. With `due`, a side already
+        having the relation is kept, and it succeeds if the other side is pushed.
+
+        :param bool due: push the relation to other person too.
+        :raise InvalidError: if the relation is existed, or a person is not existed,
+            `payload['written']` is the persons pushed anyway.
+        """
+        requests = [UpdateOne(
+            {'_id': person_id, 'relations.person_id': {'$ne': other_person_id}},
+            {'$push': {'relations': {'rel': rel, 'person_id': other_person_id}}}
+        )]
+        if due:
+            requests.append(UpdateOne(
+                {'_id': other_person_id, 'relations.person_id': {'$ne': person_id}},
+                {'$push': {'relations': {'rel': rel, 'person_id': person_id}}}
+            ))
+
+        result = cls._collection().bulk_write(requests, ordered=False)
+        cls._invalidate([person_id, other_person_id])
+        identity.discard(cls, person_id)
+        identity.discard(cls, other_person_id)
+        if result.matched_count == len(requests):
+            return True
+
+        # find out why a request is not matched, only on failure.
+        ids = [person_id, other_person_id] if due else [person_id]
+        existed = set(row['_id'] for row in cls._collection().find({'_id': {'$in': ids}}, ['_id']))
+        missing = [_id for _id in ids if _id not in existed]
+        if missing:
+            # the requests of missing persons are not matched, so the others are pushed if any matched.
+            written = [_id for _id in ids if _id in existed] if result.matched_count else []
+            message = 'person %s is not existed.' % ', '.join('`%s`' % _id for _id in missing)
+            if written:
+                message += ' the relation of %s is pushed.' % ', '.join('`%s`' % _id for _id in written)
+            raise error.InvalidError(message, payload={'written': written})
+        if not result.matched_count:
+            raise error.InvalidError('relation is existed.', payload={'written': []})
+        return True
 
     def build_relation(self, rel, other_person_id, due=False):
         item = {'rel': rel, 'person_id': other_person_id}
-        other_person_ids = [item['person_id'] for item in self.relations]
-        if other_person_id in other_person_ids:
-            raise error.InvalidError('relation is existed.')
+        try:
+            type(self).add_relation(self.get_id(), rel, other_person_id, due)
+        except error.InvalidError as e:
+            if self.get_id() in (e.payload or {}).get('written', ()):
+                self._keep_relation(item)
+            raise
+        self._keep_relation(item)
+        return True
 
-        else:
+    def _keep_relation(self, item):
+        """Keep the relation pushed by `add_relation` in memory, unless one to the same person is there."""
+        if not any(row.get('person_id') == item['person_id'] for row in self.relations):
             self.relations.append(item)
-            self.save(allow_fields=('relations',))
-            if due:
-                other_person = type(self).get_one(other_person_id)
-                other_person.build_relation(rel, self.get_id())
-
-        return True
+            self._mark_saved({type(self).relations.raw_field_key})
+        identity.add(self)
 
 
 class Group(Base):
     _table = 'groups'
     _primary_key = 'group_id'
+    # only cleared by a write in this process, other workers of `app.prefork` may
+    # read the old group until the ttl, so keep it short.
+    _cache = LRUCache(maxsize=1024, ttl=60)
 
     group_id = IDField()
     name = StringField()
     note = StringField()
+
+    @classmethod
+    def member_counts(cls, group_ids=None):
+        """Count the members of groups by one aggregation on persons.
+
+        :param list group_ids: only count these groups, all groups if None.
+        :return dict: {group_id: count}, a group without member is not in it.
+        """
+        pipeline = [
+            {'$project': {'_id': False, 'groups': True}},
+            {'$unwind': '$groups'},
+        ]
+        if group_ids is not None:
+            match = {'$match': {'groups': {'$in': list(group_ids)}}}
+            # the first one is by the index of groups, the second one drops other groups of the members.
+            pipeline = [match] + pipeline + [match]
+        pipeline.append({'$group': {'_id': '$groups', 'count': {'$sum': 1}}})
+        return {row['_id']: row['count'] for row in Person._collection().aggregate(pipeline)}
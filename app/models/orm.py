@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import base64
 import copy
 import functools
 import os
@@ -7,15 +8,46 @@ import sys
 import weakref
 import datetime
 import bson
+import bson.json_util
 import logging
 from collections import namedtuple
 
+import pymongo
+from pymongo.errors import BulkWriteError, ExecutionTimeout
+
 from app.error import InvalidError
-from app.db import db
+import app.db
+from app.db import get_db
+from .cache import LRUCache
+from . import identity
+from . import search
+from .aio import AsyncModel
 
 
 logger = logging.getLogger()
 
+# collection of each model, {cls: (generation of app.db, collection)}, see `Base._collection`.
+_collections = {}
+
+_SCALAR_TYPES = (basestring, int, long, float, bool, type(None), datetime.datetime, bson.ObjectId)
+
+
+def _snapshot(value):
+    """Copy a value for comparing later, faster than deepcopy on flat list / dict."""
+    if isinstance(value, list):
+        return [_snapshot(item) for item in value]
+    elif isinstance(value, dict):
+        return {k: _snapshot(v) for k, v in value.iteritems()}
+    elif isinstance(value, _SCALAR_TYPES):
+        return value
+    return copy.deepcopy(value)
+
+
+def _overrides(field, cls, *names):
+    """Check whether the class of `field` overrides any method `names` of `cls`."""
+    return any(getattr(type(field), name).im_func is not getattr(cls, name).im_func for name in names)
+
+
 class ModelError(InvalidError):
     """Base model operator error."""
     pass
@@ -45,29 +77,47 @@ class Field(object):
     """Decalre a propery for Model"""
     field_key = None
     raw_field_key = None
+    # field keys this field is derived from, see `prepare_save`.
+    sources = ()
 
-    def __init__(self, raw_field_key=None, **kw):
+    def __init__(self, raw_field_key=None, index=False, unique=False, sparse=False, **kw):
         """
         :param str raw_field_key:
         :param default: value or function
+        :param bool index: declare an index on this field, see `Base.ensure_indexes`.
+        :param bool unique: declare an unique index.
+        :param bool sparse: the index is sparse.
 
         """
         self.raw_field_key = raw_field_key
+        self.index = index or unique
+        self.unique = unique
+        self.sparse = sparse
 
         if 'default' in kw:
             self.default = kw['default']
 
     def __get__(self, instance, cls):
-        if not instance:
+        if instance is None:
             return self
         else:
             if self.raw_field_key not in instance._attrs:
+                if instance._fields is not None and self.field_key not in instance._fields:
+                    raise ModelInvaldError('field `%s` of `%s` is not loaded.' % (self.field_key, type(instance).__name__))
                 if hasattr(self, 'default'):
                    # if has `default`, then use this `default` to generate value
                    if hasattr(self.default, '__call__'):
-                       instance._attrs[self.raw_field_key] = self.value_in(instance, self.default())
+                       value = self.value_in(instance, self.default())
                    else:
-                       instance._attrs[self.raw_field_key] = self.value_in(instance, self.default)
+                       value = self.value_in(instance, self.default)
+                   instance._attrs[self.raw_field_key] = value
+                   if instance._persisted is False:
+                       instance._touch(self.raw_field_key)
+                   elif isinstance(value, (list, dict)):
+                       # reading a default is not a change, only save it if it is modified in place.
+                       if instance._origin is None:
+                           instance._origin = {}
+                       instance._origin[self.raw_field_key] = _snapshot(value)
                 else:
                     return None
             return self.value_out(instance, instance._attrs[self.raw_field_key])
@@ -82,6 +132,7 @@ class Field(object):
             instance._attrs[self.raw_field_key] = None
         else:
             instance._attrs[self.raw_field_key] = self.value_in(instance, value)
+        instance._touch(self.raw_field_key)
 
     def register(self, cls, field_key):
         """ Bind the property name with model cls.
@@ -100,17 +151,51 @@ class Field(object):
         """ The value from instance._attrs to external"""
         return value
 
+    def diff(self, origin, value):
+        """ Build update operators from the origin value in database to current value.
+
+        :return dict: ex: {'$push': {...}}, or None to `$set` the whole value.
+        """
+        return None
+
     def encode(self, instance, target):
         """ Encode external value to another data type that json.dumps can process. """
         if self.raw_field_key in instance._attrs:
             target[self.field_key] = getattr(instance, self.field_key)
 
+    def compile_encode(self, var):
+        """ Return a python expression which encode the raw value named `var`, for the encoder
+            generated by `Meta`. Return None to call `encode` instead, ex: a custom Field.
+        """
+        if _overrides(self, Field, 'encode', 'value_out'):
+            return None
+        return var
+
     def decode(self, instance, payload):
         """ decode external value from another data type that json.loads can process. """
         if self.field_key in payload:
             value = payload[self.field_key]
             setattr(instance, self.field_key, value)
 
+    def decode_value(self, value):
+        """ Validate and convert a not None value from json.loads to the raw value of _attrs.
+            raise ValueError or TypeError if it is invalid.
+        """
+        return value
+
+    def compile_decode(self):
+        """ Return a function convert value like `decode_value`, for the decoder build by `Meta`.
+            Return None to call `decode` instead, ex: a custom Field.
+        """
+        if _overrides(self, Field, 'decode', 'value_in'):
+            return None
+        return self.decode_value
+
+    def prepare_save(self, instance, force=False):
+        """ Derive the value from `sources` before the instance is saved.
+            Return True if the value is set.
+        """
+        return False
 
 
 class IDField(Field):
@@ -132,9 +217,26 @@ class StringField(Field):
             return value
         return "%s" % (value)
 
+    def decode_value(self, value):
+        if isinstance(value, basestring):
+            return value
+        elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+            return "%s" % (value)
+        raise TypeError('expect a string, not `%r`' % (value,))
+
+    def compile_decode(self):
+        if _overrides(self, StringField, 'decode', 'value_in'):
+            return None
+        return self.decode_value
+
     def value_out(self, instance, value):
         return value
 
+    def compile_encode(self, var):
+        if _overrides(self, StringField, 'encode', 'value_out'):
+            return None
+        return var
+
 
 class BoolField(Field):
     def __init__(self, **kw):
@@ -145,9 +247,26 @@ class BoolField(Field):
     def value_in(self, instance, value):
         return bool(value)
 
+    def decode_value(self, value):
+        if isinstance(value, bool):
+            return value
+        elif isinstance(value, (int, long)) and value in (0, 1):
+            return bool(value)
+        raise TypeError('expect a boolean, not `%r`' % (value,))
+
+    def compile_decode(self):
+        if _overrides(self, BoolField, 'decode', 'value_in'):
+            return None
+        return self.decode_value
+
     def value_out(self, instance, value):
         return value
 
+    def compile_encode(self, var):
+        if _overrides(self, BoolField, 'encode', 'value_out'):
+            return None
+        return var
+
 
 class IntField(Field):
     def __init__(self, **kw):
@@ -158,18 +277,48 @@ class IntField(Field):
     def value_in(self, instance, value):
         return int(value)
 
+    def decode_value(self, value):
+        if isinstance(value, bool):
+            raise TypeError('expect an integer, not `%r`' % (value,))
+        elif isinstance(value, (int, long)):
+            return value
+        elif isinstance(value, basestring):
+            return int(value)
+        raise TypeError('expect an integer, not `%r`' % (value,))
+
+    def compile_decode(self):
+        if _overrides(self, IntField, 'decode', 'value_in'):
+            return None
+        return self.decode_value
+
     def value_out(self, instance, value):
         return value
 
+    def compile_encode(self, var):
+        if _overrides(self, IntField, 'encode', 'value_out'):
+            return None
+        return var
+
 
 class DateField(Field):
-    def __init__(self, **kw):
+    def __init__(self, month_day=False, **kw):
         """ DateField
             :param datetime default: default can be like ex: lamda: datetime.date.today()
+            :param bool month_day: keep an indexed `MonthDayField` `<field_key>_mmdd` of it,
+                for the dates in every year, see `Base.upcoming`.
         """
         # if 'default' not in kw:
         #    kw['default'] = datetime.datetime.now().replace(minute=0, hour=0, second=0, microsecond=0)
         super(DateField, self).__init__(**kw)
+        self.month_day = month_day
+        self.month_day_field = None
+
+    def register(self, cls, field_key):
+        super(DateField, self).register(cls, field_key)
+        if self.month_day:
+            self.month_day_field = MonthDayField(field_key, raw_field_key=self.raw_field_key + '_mmdd', index=True)
+            setattr(cls, field_key + '_mmdd', self.month_day_field)
+            self.month_day_field.register(cls, field_key + '_mmdd')
 
     def value_in(self, instance, value):
         if isinstance(value, datetime.date):
@@ -185,6 +334,11 @@ class DateField(Field):
         if self.raw_field_key in instance._attrs:
             target[self.field_key] = getattr(instance, self.field_key).strftime('%Y-%m-%d')
 
+    def compile_encode(self, var):
+        if _overrides(self, DateField, 'encode', 'value_out'):
+            return None
+        return "(%(v)s if %(v)s is None else '%%04d-%%02d-%%02d' %% (%(v)s.year, %(v)s.month, %(v)s.day))" % {'v': var}
+
     def decode(self, instance, payload):
         if self.field_key in payload:
             try:
@@ -194,19 +348,99 @@ class DateField(Field):
                 logger.warning(e)
                 logger.warning('can not decode `%s` `%s`', self.field_key, payload[self.field_key])
 
+    def decode_value(self, value):
+        if isinstance(value, basestring):
+            # fast path for ISO date `YYYY-MM-DD`
+            if len(value) == 10 and value[4] == '-' and value[7] == '-':
+                return datetime.datetime(int(value[:4]), int(value[5:7]), int(value[8:]))
+            return datetime.datetime.strptime(value, '%Y-%m-%d')
+        elif isinstance(value, (datetime.date, datetime.datetime)):
+            return self.value_in(None, value)
+        raise TypeError('expect a date string `YYYY-MM-DD`, not `%r`' % (value,))
+
+    def compile_decode(self):
+        if _overrides(self, DateField, 'decode', 'value_in'):
+            return None
+        return self.decode_value
+
+
+class MonthDayField(Field):
+    """Month and day of a `DateField` as an integer `MMDD`, ex: 1225 for 2016-12-25.
+
+    It is derived on save, hidden from `to_jsonify` and can not be set by `from_jsonify`.
+    """
+
+    def __init__(self, source, **kw):
+        """ MonthDayField.
+            :param str source: field key of the `DateField`.
+        """
+        super(MonthDayField, self).__init__(**kw)
+        self.sources = (source,)
+
+    def value_in(self, instance, value):
+        return int(value)
+
+    def encode(self, instance, target):
+        pass
+
+    def decode(self, instance, payload):
+        pass
+
+    def prepare_save(self, instance, force=False):
+        source = instance._config[self.sources[0]].raw_field_key
+        if not force and instance._persisted and source not in (instance._dirty or ()):
+            return False
+        date = instance._attrs.get(source)
+        setattr(instance, self.field_key, date.month * 100 + date.day if date else None)
+        return True
 
 
 class ListField(Field):
-    def __init__(self, **kw):
+    def __init__(self, incremental=False, **kw):
         """ ListField.
+            :param bool incremental: save append/remove by `$push`/`$pull` instead of `$set` whole list.
         """
         if 'default' not in kw:
             kw['default'] = lambda: []
         super(ListField, self).__init__(**kw)
+        self.incremental = incremental
+
+    def __get__(self, instance, cls):
+        if instance is not None and instance._persisted:
+            # the list may be modified in place, keep a snapshot to find out changes on save.
+            raw_field_key = self.raw_field_key
+            if instance._origin is None:
+                instance._origin = {}
+            if raw_field_key in instance._attrs and raw_field_key not in instance._origin and \
+                    not (instance._dirty and raw_field_key in instance._dirty):
+                instance._origin[raw_field_key] = _snapshot(instance._attrs[raw_field_key])
+        return super(ListField, self).__get__(instance, cls)
 
     def value_in(self, instance, value):
         return list(value)
 
+    def decode_value(self, value):
+        if isinstance(value, list):
+            return value
+        raise TypeError('expect a list, not `%r`' % (value,))
+
+    def compile_decode(self):
+        if _overrides(self, ListField, 'decode', 'value_in'):
+            return None
+        return self.decode_value
+
+    def diff(self, origin, value):
+        if not self.incremental or not isinstance(origin, list) or not isinstance(value, list):
+            return None
+
+        if len(value) > len(origin) and value[:len(origin)] == origin:
+            return {'$push': {self.raw_field_key: {'$each': value[len(origin):]}}}
+
+        removed = [item for item in origin if item not in value]
+        if removed and [item for item in origin if item not in removed] == value:
+            return {'$pull': {self.raw_field_key: {'$in': removed}}}
+        return None
+
 
 class TupleField(Field):
 
@@ -240,6 +474,46 @@ class TupleField(Field):
                 logger.warning(e)
                 logger.warning('can not decode `%s` `%s`', self.field_key, payload[self.field_key])
 
+    def decode_value(self, value):
+        if isinstance(value, dict):
+            return self.value_in(None, self.np(**value))
+        raise TypeError('expect an object, not `%r`' % (value,))
+
+    def compile_decode(self):
+        if _overrides(self, TupleField, 'decode', 'value_in'):
+            return None
+        return self.decode_value
+
+
+class SearchField(ListField):
+    """Search keys derived from string fields on save, see `Base.search`.
+
+    It is hidden from `to_jsonify` and can not be set by `from_jsonify`.
+    """
+
+    def __init__(self, *sources, **kw):
+        """ SearchField.
+            :param sources: field keys of the texts, ex: SearchField('name')
+        """
+        if not sources:
+            raise ModelDeclareError('Declare a search field without sources.')
+        super(SearchField, self).__init__(**kw)
+        self.sources = sources
+
+    def encode(self, instance, target):
+        pass
+
+    def decode(self, instance, payload):
+        pass
+
+    def prepare_save(self, instance, force=False):
+        if not force and instance._persisted:
+            dirty = instance._dirty or ()
+            if not any(instance._config[k].raw_field_key in dirty for k in self.sources):
+                return False
+        setattr(instance, self.field_key, search.build_keys(*[getattr(instance, k) for k in self.sources]))
+        return True
+
 
 class ClassReadonlyProperty(object):
     """a propery declare on class, and it is readonly and share with all instance.
@@ -263,27 +537,40 @@ class ClassReadonlyProperty(object):
         raise ModelInvaldError('`ClassReadonlyProperty` is readonly.')
 
 
-class InstanceReadonlyProperty(object):
-    def __init__(self, default_value=lambda: None):
-        self.default_value = default_value
-        self.values = weakref.WeakKeyDictionary()
+def _compile_encoder(cls):
+    """Generate a function encode the instance of `cls` to a dict, see `Base.to_jsonify`.
 
-    def __get__(self, instance, cls):
-        if instance:
-            if instance not in self.values:
-                if hasattr(self.default_value, '__call__'):
-                    self.values[instance] = self.default_value()
-                else:
-                    self.values[instance] = self.default_value
-            return self.values[instance]
-        raise ModelInvaldError('`InstanceReadonlyProperty` can not work on class level.')
+    It reads `_attrs` directly instead of `Field.__get__`, and falls back
+    to `Field.encode` for the fields can not be compiled.
+    """
+    namespace = {'_class_name': cls.__name__}
+    lines = [
+        'def encode(instance):',
+        '    attrs = instance._attrs',
+        '    result = {\'__class__\': _class_name}',
+    ]
+    for i, (field_key, field) in enumerate(sorted(cls._config.items())):
+        expr = field.compile_encode('value')
+        if expr is None:
+            namespace['_field_%d' % i] = field
+            lines.append('    _field_%d.encode(instance, result)' % i)
+        else:
+            lines.append('    if %r in attrs:' % field.raw_field_key)
+            lines.append('        value = attrs[%r]' % field.raw_field_key)
+            lines.append('        result[%r] = %s' % (field_key, expr))
+    lines.append('    return result')
 
-    def __set__(self):
-        raise ModelInvaldError('`InstanceReadonlyProperty` is readonly.')
+    exec compile('\n'.join(lines), '<encoder of %s>' % cls.__name__, 'exec') in namespace
+    return namespace['encode']
 
 
 class Meta(type):
+    # declared models by class name.
+    registry = {}
+
     def __new__(meta_cls, cls_name, cls_bases, cls_dict):
+        # instances only keep the slots declared on `Base`, no __dict__ and __weakref__.
+        cls_dict.setdefault('__slots__', ())
         cls = type.__new__(meta_cls, cls_name, cls_bases, cls_dict)
         if cls_name == 'Base':
             return cls
@@ -301,23 +588,139 @@ class Meta(type):
 
             if cls._primary_key is None:
                 raise ModelDeclareError('declare Moedl without IDField.')
+
+        cls._encoder = staticmethod(_compile_encoder(cls))
+        cls._decoders = {field_key: (field, field.compile_decode()) for field_key, field in cls._config.iteritems()}
+        cls._prepare_fields = tuple(field for field in cls._config.itervalues() if _overrides(field, Field, 'prepare_save'))
+        # the derived fields are only written by `prepare_save`, and not loaded unless asked, see `_projection`.
+        cls._default_projection = {field.raw_field_key: False for field in cls._prepare_fields} or None
+        meta_cls.registry[cls_name] = cls
         return cls
 
 
 class FetchResult(object):
-    def __init__(self, cls, cursor):
+    # the ceiling of `page_size` of `paginate`.
+    MAX_PAGE_SIZE = 1000
+
+    def __init__(self, cls, cursor, fields=None, query=None):
+        """
+        :param list fields: the cursor is projected on these fields, see `Base.fetch`.
+        :param dict query: the query of cursor, for `paginate`.
+        """
         self.cls = cls
+        self.fields = fields
+        self.query = query or {}
         self.root_cursor = cursor
         self.cursor = self.root_cursor.clone()
 
+        # looked up once, not for every row.
+        self._identity_map = identity.current() if fields is None else None
+        self.page_size = None
+        self.sort_key = None
+        # the sort key is only loaded for the token if it is not in `fields`.
+        self._drop_sort_key = False
+        self._last = None
+        self._count = 0
+
     def __iter__(self):
         return self
 
     def __getitem__(self, key):
-        return self.cls.get_one(raw=self.cursor[key])
+        return self.cls._load(self.cursor[key], self.fields, track=False, identity_map=self._identity_map)
 
     def next(self):
-        return self.cls.get_one(raw=next(self.cursor))
+        raw = next(self.cursor)
+        self._count += 1
+        if self.sort_key:
+            if self._drop_sort_key:
+                self._last = (raw.pop(self.sort_key, None), raw['_id'])
+            else:
+                self._last = (raw.get(self.sort_key), raw['_id'])
+        # do not keep every row in identity map, or a long iteration will hold all of them.
+        return self.cls._load(raw, self.fields, track=False, identity_map=self._identity_map)
+
+    def paginate(self, page_size, page_token=None, sort_key=None):
+        """Keyset pagination, ordered by (sort_key, _id).
+
+        Each page is a range query after the last row of previous page,
+        so the cost of page 500 is the same as page 1, unlike `skip`.
+
+        :param int page_size: rows per page, limited by `MAX_PAGE_SIZE`.
+        :param str page_token: `next_page_token` of previous page, None for first page.
+        :param str sort_key: field key to sort, default is the primary key.
+            It is ignored if page_token is given, the token keeps its sort key.
+        :rtype: FetchResult
+        """
+        cls = self.cls
+        page_size = max(1, min(int(page_size), self.MAX_PAGE_SIZE))
+        query = self.query
+
+        if page_token:
+            raw_sort_key, value, last_id = self._decode_token(page_token)
+            if raw_sort_key not in set(field.raw_field_key for field in cls._config.values()):
+                raise ModelInvaldError('invalid page token `%s`.' % page_token)
+            if value is None:
+                after = {'$or': [
+                    {raw_sort_key: None, '_id': {'$gt': last_id}},
+                    {raw_sort_key: {'$ne': None}},
+                ]}
+            elif raw_sort_key == '_id':
+                after = {'_id': {'$gt': value}}
+            else:
+                after = {'$or': [
+                    {raw_sort_key: {'$gt': value}},
+                    {raw_sort_key: value, '_id': {'$gt': last_id}},
+                ]}
+            query = {'$and': [query, after]} if query else after
+        else:
+            sort_key = sort_key or cls._primary_key
+            if sort_key not in cls._config:
+                raise ModelInvaldError('`%s` has no field `%s` to sort.' % (cls.__name__, sort_key))
+            raw_sort_key = cls._config[sort_key].raw_field_key
+
+        projection = cls._default_projection
+        drop_sort_key = False
+        if self.fields is not None:
+            projection = cls._projection(self.fields)
+            drop_sort_key = raw_sort_key not in projection
+            projection[raw_sort_key] = True
+        elif projection and raw_sort_key in projection:
+            projection = dict(projection)
+            del projection[raw_sort_key]
+
+        sort = [(raw_sort_key, pymongo.ASCENDING)]
+        if raw_sort_key != '_id':
+            sort.append(('_id', pymongo.ASCENDING))
+        cursor = cls._find(query, projection=projection).sort(sort).limit(page_size)
+
+        result = FetchResult(cls, cursor, self.fields, self.query)
+        result.page_size = page_size
+        result.sort_key = raw_sort_key
+        result._drop_sort_key = drop_sort_key
+        return result
+
+    @property
+    def next_page_token(self):
+        """The opaque token of next page after iterate this page, None if it is the last page."""
+        if not self.page_size or self._count < self.page_size or self._last is None:
+            return None
+        token = bson.json_util.dumps([self.sort_key, self._last[0], self._last[1]])
+        return base64.urlsafe_b64encode(token)
+
+    def next_page(self):
+        """Return the FetchResult of next page, or None."""
+        token = self.next_page_token
+        if not token:
+            return None
+        return self.paginate(self.page_size, token)
+
+    @classmethod
+    def _decode_token(cls, page_token):
+        try:
+            raw_sort_key, value, last_id = bson.json_util.loads(base64.urlsafe_b64decode(str(page_token)))
+            return raw_sort_key, value, last_id
+        except Exception:
+            raise ModelInvaldError('invalid page token `%s`.' % page_token)
 
     def sort(self, key, sort):
         self.cursor = self.cursor.sort(key, sort)
@@ -331,6 +734,10 @@ class FetchResult(object):
         self.cursor = self.cursor.skip(skip)
         return self
 
+    def batch_size(self, batch_size):
+        self.cursor = self.cursor.batch_size(batch_size)
+        return self
+
     def rewind(self):
         self.cursor.rewind()
         return self
@@ -341,43 +748,227 @@ class FetchResult(object):
 
     @property
     def total(self):
-        return self.root_cursor.count()
+        """Count of the query, without pagination, see `Base.count`."""
+        return self.cls.count(self.query)
+
+
+class BulkResult(object):
+    """Summary of `Base.bulk_create` / `Base.bulk_save`.
+
+    `errors` is a list of dict, each one point to the index of the input item:
+
+    .. code-block:: python
+
+        {'index': 3, 'code': 11000, 'message': 'E11000 duplicate key error ...'}
+
+    The index is None for an error of write concern, the items are written
+    but not acknowledged as the write concern asked.
+    """
+
+    def __init__(self):
+        self.instances = []
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.upserted_count = 0
+        self.errors = []
+
+    def add_error(self, index, message, code=None):
+        self.errors.append({'index': index, 'code': code, 'message': message})
+
+    @property
+    def success(self):
+        return not self.errors
 
 
 class Base(object):
     __metaclass__ = Meta
 
+    # _attrs: the raw document of database.
+    # _persisted: True if load from database, False if it is new,
+    #             and None if unknown (ex: from_jsonify), then save() will upsert it.
+    # _dirty: raw keys changed since load or last save, None if nothing.
+    # _origin: snapshots of mutable values since load or last save, see `ListField`.
+    # _fields: field keys loaded by a projection, None if all fields are loaded.
+    __slots__ = ('_attrs', '_persisted', '_dirty', '_origin', '_fields')
+
     _config = ClassReadonlyProperty(lambda: {})
-    _attrs = InstanceReadonlyProperty(lambda: {})
+    # cache of `count` by query, cleared on write.
+    _count_cache = ClassReadonlyProperty(lambda: LRUCache(maxsize=256, ttl=60))
+    # opt-in read-through cache of `get_one` by _id, ex: `_cache = LRUCache(maxsize=1000, ttl=60)`
+    # it is cleared by the writes of this process only, the ttl bounds how stale other processes are.
+    _cache = ClassReadonlyProperty()
+    # other indexes than `Field(index=True)`, each one is like
+    # {'keys': [('name', 1), ('phone_0', 1)], 'unique': False, 'sparse': False, 'expireAfterSeconds': 3600}
+    # keys can be field keys or raw keys, ex: [('name', 'text')] for a text index.
+    _indexes = ClassReadonlyProperty(lambda: [])
+    # functions called by `hook(cls, ids)` after write, see `_invalidate`.
+    _write_hooks = ClassReadonlyProperty(lambda: [])
+
+    # the queries in greenlets, ex: `Person.aio.get_one(_id).get()`, see `app.models.aio`.
+    aio = AsyncModel()
 
     _table = ClassReadonlyProperty()
     _primary_key = ClassReadonlyProperty()
 
     @classmethod
-    def _find(cls, query={}):
+    def _collection(cls):
+        """The collection of this model, resolved once until the client is created again.
+
+        `db[cls._table]` dispatches by `LocalProxy` and builds a new `Collection` on every call.
+        """
+        generation = app.db.generation()
+        cached = _collections.get(cls)
+        if cached is None or cached[0] != generation:
+            cached = _collections[cls] = (generation, app.db.find_db()[cls._table])
+        return cached[1]
+
+    @classmethod
+    def _find(cls, query={}, projection=None):
         """Proxy to db.collection.find."""
-        return db[cls._table].find(query)
+        return cls._collection().find(query, projection=projection)
+
+    @classmethod
+    def _projection(cls, fields=None):
+        """Build projection of raw keys by field keys, the primary key is always included.
+
+        :param list fields: field keys, or None for all fields except the derived ones, ex: `SearchField`.
+        """
+        if fields is None:
+            return {field.raw_field_key: True for field in cls._config.values() if field not in cls._prepare_fields}
+
+        projection = {cls._config[cls._primary_key].raw_field_key: True}
+        for field_key in fields:
+            if field_key not in cls._config:
+                raise ModelInvaldError('`%s` has no field `%s`.' % (cls.__name__, field_key))
+            projection[cls._config[field_key].raw_field_key] = True
+        return projection
+
+    @classmethod
+    def _invalidate(cls, ids=None):
+        """Clear the caches of this model after write, and call the `_write_hooks`.
+
+        :param list ids: _id of written documents, None if unknown.
+        """
+        cls._count_cache.clear()
+        if cls._cache is not None:
+            if ids is None:
+                cls._cache.clear()
+            else:
+                for _id in ids:
+                    cls._cache.pop(_id)
+        for hook in cls._write_hooks:
+            try:
+                hook(cls, ids)
+            except Exception as e:
+                logger.exception(e)
+
+    @classmethod
+    def count(cls, query={}, max_time_ms=1000):
+        """Count documents by query, the result is cached until expired or any write of this model.
+
+        Unfiltered count is estimated by collection metadata, and filtered count is
+        canceled after `max_time_ms`, then return None.
+        """
+        key = bson.json_util.dumps(query, sort_keys=True)
+        total = cls._count_cache.get(key)
+        if total is not None:
+            return total
+
+        collection = cls._collection()
+        try:
+            if not query:
+                if hasattr(collection, 'estimated_document_count'):
+                    total = collection.estimated_document_count()
+                else:
+                    total = collection.count()
+            elif hasattr(collection, 'count_documents'):
+                total = collection.count_documents(query, maxTimeMS=max_time_ms)
+            else:
+                total = collection.count(query, maxTimeMS=max_time_ms)
+        except ExecutionTimeout:
+            logger.warning('count `%s` by %s over %sms', cls._table, key, max_time_ms)
+            return None
+
+        cls._count_cache.set(key, total)
+        return total
+
+    @classmethod
+    def index_models(cls):
+        """Build pymongo.IndexModel of declared indexes."""
+        specs = []
+        for field_key, field in sorted(cls._config.items()):
+            if field.index and field.raw_field_key != '_id':
+                spec = {'keys': [(field_key, pymongo.ASCENDING)]}
+                if field.unique:
+                    spec['unique'] = True
+                if field.sparse:
+                    spec['sparse'] = True
+                specs.append(spec)
+        specs.extend(cls._indexes)
+
+        models = []
+        for spec in specs:
+            spec = dict(spec)
+            keys = [(cls._config[k].raw_field_key if k in cls._config else k, direction)
+                    for k, direction in spec.pop('keys')]
+            spec.setdefault('name', '_'.join('%s_%s' % (k, direction) for k, direction in keys))
+            models.append(pymongo.IndexModel(keys, **spec))
+        return models
+
+    @classmethod
+    def ensure_indexes(cls):
+        """Create the declared indexes which are not existed, they are built in background.
+
+        :return list: names of created indexes.
+        """
+        collection = cls._collection()
+        existed_names = set()
+        existed_keys = set()
+        for index in collection.list_indexes():
+            existed_names.add(index['name'])
+            existed_keys.add(tuple(index['key'].items()))
+
+        missing = []
+        for model in cls.index_models():
+            document = model.document
+            if document['name'] in existed_names or tuple(document['key'].items()) in existed_keys:
+                continue
+            document['background'] = True
+            missing.append(model)
+
+        if not missing:
+            return []
+        logger.info('create indexes of `%s`: %s', cls._table, [model.document['name'] for model in missing])
+        return collection.create_indexes(missing)
 
     @classmethod
     def _insert_one(cls, payload):
         """Proxy to db.collection.insert_one."""
-        result = db[cls._table].insert_one(payload)
+        result = cls._collection().insert_one(payload)
+        cls._invalidate([result.inserted_id])
         if not result.inserted_id:
             raise ModelInvaldError('create instance fail.')
         return result.inserted_id
 
     @classmethod
-    def _update_one(cls, query={}, payload={}):
-        """Proxy to db.collection.update_one."""
+    def _update_one(cls, query={}, payload={}, operators=None):
+        """Proxy to db.collection.update_one.
+
+        :param dict payload: values to `$set`.
+        :param dict operators: other update operators, ex: {'$push': {...}}
+        """
         if not query:
             raise ModelInvaldError('can update by empty query.')
 
-        if not payload:
+        if not payload and not operators:
             raise ModelInvaldError('can update by empty payload.')
 
-        result = db[cls._table].update_one(query, {
-            '$set': payload
-        })
+        update = dict(operators or {})
+        if payload:
+            update['$set'] = payload
+        result = cls._collection().update_one(query, update)
+        cls._invalidate([query['_id']] if '_id' in query and not isinstance(query['_id'], dict) else None)
 
         if result.matched_count == 1:
             return True
@@ -385,27 +976,237 @@ class Base(object):
             return False
 
     @classmethod
-    def get_one(cls, _id=None, raw=None):
+    def _upsert_one(cls, query={}, payload={}):
+        """Proxy to db.collection.update_one with upsert."""
+        if not query:
+            raise ModelInvaldError('can upsert by empty query.')
+
+        update = {'$set': payload} if payload else {'$setOnInsert': query}
+        result = cls._collection().update_one(query, update, upsert=True)
+        cls._invalidate([query['_id']] if '_id' in query and not isinstance(query['_id'], dict) else None)
+        if result.matched_count == 1 or result.upserted_id is not None:
+            return True
+        else:
+            return False
+
+    @classmethod
+    def get_one(cls, _id=None, raw=None, fields=None):
+        """Load an instance by _id, or hydrate it from a raw document.
+
+        :param list fields: only load these fields, the others can not be read or saved.
+        """
         if _id and raw is None:
-            raw = db[cls._table].find_one({'_id': _id}, projection={field.raw_field_key: True for field in cls._config.values()})
-            if not raw:
-                return None
+            if fields is None:
+                instance = identity.get(cls, _id)
+                if instance is not None:
+                    return instance
+            raw = None
+            cache = cls._cache if fields is None else None
+            if cache is not None:
+                raw = cache.get(_id)
+                if raw is not None:
+                    # instance adopt the raw document, do not share the cached one.
+                    raw = _snapshot(raw)
+
+            if raw is None:
+                raw = cls._collection().find_one({'_id': _id}, projection=cls._projection(fields))
+                if not raw:
+                    return None
+                if cache is not None:
+                    cache.set(_id, _snapshot(raw))
         elif raw and _id is None:
             pass
         else:
             raise ModelInvaldError('get_one arguemtn errors.')
 
-        instance = cls({})
-        instance._attrs.update(raw)
+        return cls._load(raw, fields)
+
+    @classmethod
+    def get_many(cls, ids, fields=None, chunk_size=500):
+        """Load instances by a list of _id with a few `$in` query.
+
+        :param list ids:
+        :param list fields: only load these fields, see `get_one`.
+        :param int chunk_size: max _id of each query.
+        :return list: instances in the order of ids, None if it is not existed.
+        """
+        found = {}
+        missing = []
+        seen = set()
+        identity_map = identity.current() if fields is None else None
+        for _id in ids:
+            if _id in seen:
+                continue
+            seen.add(_id)
+            instance = identity_map.get((cls, _id)) if fields is None else None
+            if instance is not None:
+                found[_id] = instance
+            else:
+                missing.append(_id)
+
+        projection = cls._projection(fields)
+        for start in xrange(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            for raw in cls._find({'_id': {'$in': chunk}}, projection=projection):
+                found[raw['_id']] = cls._load(raw, fields, identity_map=identity_map)
+        return [found.get(_id) for _id in ids]
+
+    @classmethod
+    def _load(cls, raw, fields=None, track=True, identity_map=None):
+        """Hydrate an instance, it is shared by the identity map of current request.
+
+        :param bool track: keep the new instance in identity map.
+        :param dict identity_map: `identity.current()` looked up once by the caller of many rows,
+            or None to look it up here.
+        """
+        if fields is not None:
+            return cls._from_raw(raw, fields)
+        if identity_map is None:
+            identity_map = identity.current()
+        key = (cls, raw['_id'])
+        instance = identity_map.get(key)
+        if instance is None:
+            instance = cls._from_raw(raw)
+            if track:
+                identity_map[key] = instance
         return instance
 
     @classmethod
-    def fetch(cls, query={}, sort=None, offset=None, limit=None):
-        cursor = cls._find(query)
-        return FetchResult(cls, cursor)
+    def _from_raw(cls, raw, fields=None):
+        """Hydrate an instance by adopting the raw document without copy."""
+        instance = cls.__new__(cls)
+        instance._attrs = raw
+        instance._persisted = True
+        instance._dirty = None
+        instance._origin = None
+        instance._fields = None if fields is None else frozenset(fields) | {cls._primary_key}
+        return instance
 
     @classmethod
-    def create(cls, payload={}):
+    def fetch(cls, query={}, sort=None, offset=None, limit=None, fields=None):
+        """Find instances by query.
+
+        :param list fields: only load these fields, see `get_one`.
+        """
+        cursor = cls._find(query, projection=cls._projection(fields) if fields is not None else cls._default_projection)
+        return FetchResult(cls, cursor, fields, query)
+
+    @classmethod
+    def _search_field(cls):
+        for field in cls._prepare_fields:
+            if isinstance(field, SearchField):
+                return field
+        raise ModelInvaldError('`%s` has no `SearchField`.' % cls.__name__)
+
+    @classmethod
+    def search_query(cls, term):
+        """Build the query to find the term by `SearchField`, an empty query if term is empty.
+
+        A term longer than `search.MAX_KEY_LENGTH` is found by its first chars,
+        then filtered by `search.pattern` on the sources.
+        """
+        key = search.query_key(term)
+        if key is None:
+            return {}
+        field = cls._search_field()
+        query = {field.raw_field_key: key}
+        if len(search.normalize(term)) > search.MAX_KEY_LENGTH:
+            regex = {'$regex': search.pattern(term), '$options': 'i'}
+            sources = [cls._config[k].raw_field_key for k in field.sources]
+            if len(sources) == 1:
+                query[sources[0]] = regex
+            else:
+                query['$or'] = [{source: regex} for source in sources]
+        return query
+
+    @classmethod
+    def search(cls, term, limit=20, fields=None):
+        """Find instances by the `SearchField`, the prefix matches go first, then the substring matches.
+
+        Each part is sorted by the first source of the field, the index like
+        {'keys': [('search_keys', 1), ('name', 1)]} should be declared for it.
+
+        :param str term:
+        :param int limit: max instances.
+        :param list fields: only load these fields, see `get_one`.
+        :return list: instances.
+        """
+        field = cls._search_field()
+        sources = [cls._config[k].raw_field_key for k in field.sources]
+        term = search.normalize(term)
+        if not term or limit < 1:
+            return []
+        # a term longer than the keys is matched by its first chars, then filter out the others.
+        exact = len(term) <= search.MAX_KEY_LENGTH
+
+        projection = cls._default_projection
+        identity_map = None
+        if fields is not None:
+            fields = list(fields) + list(field.sources)
+            projection = cls._projection(fields)
+        else:
+            identity_map = identity.current()
+
+        instances = []
+        found = []
+        for prefix in (True, False):
+            query = {field.raw_field_key: search.query_key(term, prefix=prefix)}
+            if found:
+                query['_id'] = {'$nin': found}
+            cursor = cls._find(query, projection=projection).sort(sources[0], pymongo.ASCENDING)
+            if exact:
+                cursor = cursor.limit(limit - len(instances))
+            for raw in cursor:
+                if not exact and not any(term in search.normalize(raw.get(k)) for k in sources):
+                    continue
+                found.append(raw['_id'])
+                instances.append(cls._load(raw, fields, track=False, identity_map=identity_map))
+                if len(instances) >= limit:
+                    return instances
+        return instances
+
+    @classmethod
+    def upcoming(cls, field_key, days=14, today=None, fields=None):
+        """Find instances whose date of `field_key` in this year is in the next `days`, ex: birthdays.
+
+        The `DateField` should be declared with `month_day=True`, and the instances are
+        in the order of date from today, the range can cross the end of year.
+
+        :param str field_key: a `DateField`.
+        :param int days: include today.
+        :param datetime.date today: default is today.
+        :param list fields: only load these fields, see `get_one`.
+        :return list: instances.
+        """
+        field = cls._config.get(field_key)
+        if not isinstance(field, DateField) or not field.month_day:
+            raise ModelInvaldError('`%s.%s` is not a `DateField` with month_day.' % (cls.__name__, field_key))
+        if days < 1:
+            return []
+
+        key = field.month_day_field.raw_field_key
+        today = today or datetime.date.today()
+        start = today.month * 100 + today.day
+        if days >= 366:
+            ranges = [(start, 1231), (101, start - 1)]
+        else:
+            last = today + datetime.timedelta(days=days - 1)
+            end = last.month * 100 + last.day
+            # Feb 29 is between 228 and 301 in every year.
+            ranges = [(start, end)] if start <= end else [(start, 1231), (101, end)]
+
+        projection = cls._projection(fields) if fields is not None else cls._default_projection
+        identity_map = identity.current() if fields is None else None
+        instances = []
+        for low, high in ranges:
+            cursor = cls._find({key: {'$gte': low, '$lte': high}}, projection=projection)
+            for raw in cursor.sort(key, pymongo.ASCENDING):
+                instances.append(cls._load(raw, fields, track=False, identity_map=identity_map))
+        return instances
+
+    @classmethod
+    def _apply_defaults(cls, payload):
+        """Fill the `default` of fields which are not in payload."""
         for field_key, field in cls._config.iteritems():
             if field_key not in payload:
                 if hasattr(field, 'default'):
@@ -413,14 +1214,173 @@ class Base(object):
                         payload[field_key] = field.default()
                     else:
                         payload[field_key] = field.default
+        return payload
+
+    @classmethod
+    def create(cls, payload={}):
+        payload = cls._apply_defaults(payload)
         instance = cls(payload)
+        instance._persisted = False
         instance.save()
-        return instance
+        return identity.add(instance)
+
+    @classmethod
+    def backfill(cls, query={}, batch_size=1000):
+        """Derive the fields of saved documents again, ex: after a `SearchField` is declared.
+
+        :param dict query: only these documents.
+        :rtype: BulkResult, without `instances`.
+        """
+        result = BulkResult()
+        if not cls._prepare_fields:
+            return result
+
+        sources = set(k for field in cls._prepare_fields for k in field.sources)
+        cursor = cls._find(query, projection=cls._projection(sources)).batch_size(batch_size)
+        requests = []
+        indexes = []
+        for index, raw in enumerate(cursor):
+            instance = cls._from_raw(raw, sources)
+            instance._prepare_save(force=True)
+            update, _ = instance._changes()
+            if update:
+                requests.append(pymongo.UpdateOne({'_id': raw['_id']}, update))
+                indexes.append(index)
+            if len(requests) >= batch_size:
+                cls._bulk_write(requests, indexes, result, ordered=False, batch_size=batch_size)
+                requests = []
+                indexes = []
+        cls._bulk_write(requests, indexes, result, ordered=False, batch_size=batch_size)
+        return result
+
+    @classmethod
+    def _bulk_write(cls, requests, indexes, result, ordered=True, batch_size=1000):
+        """Send `requests` by db.collection.bulk_write in batches.
+
+        :param list requests: pymongo write operations.
+        :param list indexes: the index of input item for each request, for report errors.
+        :param BulkResult result:
+        :return list: the index of input items which are written.
+        """
+        written = []
+        for start in xrange(0, len(requests), batch_size):
+            batch = requests[start:start + batch_size]
+            batch_indexes = indexes[start:start + batch_size]
+            try:
+                r = get_db('bulk')[cls._table].bulk_write(batch, ordered=ordered)
+                cls._invalidate()
+                result.inserted_count += r.inserted_count
+                result.matched_count += r.matched_count
+                result.modified_count += r.modified_count
+                result.upserted_count += r.upserted_count
+                written.extend(batch_indexes)
+            except BulkWriteError as e:
+                cls._invalidate()
+                details = e.details
+                result.inserted_count += details.get('nInserted', 0)
+                result.matched_count += details.get('nMatched', 0)
+                result.modified_count += details.get('nModified', 0)
+                result.upserted_count += details.get('nUpserted', 0)
+                failed = set()
+                for err in details.get('writeErrors', []):
+                    failed.add(err['index'])
+                    result.add_error(batch_indexes[err['index']], err.get('errmsg'), err.get('code'))
+                for err in details.get('writeConcernErrors', []):
+                    result.add_error(None, err.get('errmsg'), err.get('code'))
+
+                if ordered and failed:
+                    written.extend(batch_indexes[:min(failed)])
+                    break
+                # an error of write concern does not stop an ordered bulk, like mongodb.
+                written.extend(index for i, index in enumerate(batch_indexes) if i not in failed)
+        return written
+
+    @classmethod
+    def bulk_create(cls, payloads, ordered=True, batch_size=1000):
+        """Create many instances by a few `bulk_write`.
+
+        :param list payloads: list of dict, like the payload of `create`.
+        :param bool ordered: stop on first error if ordered.
+        :param int batch_size: max operators for each bulk_write.
+        :rtype: BulkResult
+        """
+        result = BulkResult()
+        requests = []
+        indexes = []
+        for index, payload in enumerate(payloads):
+            try:
+                instance = cls(cls._apply_defaults(dict(payload)))
+            except (InvalidError, ValueError, TypeError) as e:
+                result.instances.append(None)
+                result.add_error(index, '%s' % e)
+                if ordered:
+                    break
+                continue
+            result.instances.append(instance)
+            instance._prepare_save()
+            doc = instance._raw_payload()
+            doc['_id'] = instance._attrs[instance._config[instance._primary_key].raw_field_key]
+            requests.append(pymongo.InsertOne(doc))
+            indexes.append(index)
+
+        for index in cls._bulk_write(requests, indexes, result, ordered=ordered, batch_size=batch_size):
+            result.instances[index]._persisted = True
+            result.instances[index]._mark_saved()
+        return result
+
+    @classmethod
+    def bulk_save(cls, instances, allow_fields=None, ordered=True, batch_size=1000):
+        """Save many instances by a few `bulk_write`.
+
+        New instances are inserted, the instances from database are updated by `$set`,
+        and the others are upserted.
+
+        :param list instances:
+        :param list allow_fields: it will only save allow_fields.
+        :param bool ordered: stop on first error if ordered.
+        :param int batch_size: max operators for each bulk_write.
+        :rtype: BulkResult
+        """
+        result = BulkResult()
+        result.instances = list(instances)
+
+        requests = []
+        indexes = []
+        saved_keys = {}
+        for index, instance in enumerate(result.instances):
+            instance_fields = instance._prepare_save(allow_fields)
+            if instance._persisted:
+                update, saved_keys[index] = instance._changes(instance_fields)
+                if not update:
+                    continue
+                requests.append(pymongo.UpdateOne({'_id': instance.get_id()}, update))
+            else:
+                payload = instance._raw_payload(instance_fields)
+                saved_keys[index] = set(payload) | {'_id'}
+                if instance._persisted is False:
+                    payload['_id'] = instance.get_id()
+                    requests.append(pymongo.InsertOne(payload))
+                elif payload:
+                    requests.append(pymongo.UpdateOne({'_id': instance.get_id()}, {'$set': payload}, upsert=True))
+                else:
+                    continue
+            indexes.append(index)
+
+        for index in cls._bulk_write(requests, indexes, result, ordered=ordered, batch_size=batch_size):
+            result.instances[index]._persisted = True
+            result.instances[index]._mark_saved(saved_keys[index])
+        return result
 
     def __init__(self, payload={}):
         """ Do not use Foo() to create new instance.
         instate cls.create or cls.get_one() is better.
         """
+        self._attrs = {}
+        self._persisted = None
+        self._dirty = None
+        self._origin = None
+        self._fields = None
+
         for field_key, value in payload.items():
             if field_key in self._config:
                 setattr(self, field_key, value)
@@ -437,19 +1397,20 @@ class Base(object):
         #primary_field = self._config[self._primary_key]
         # if primary_field.raw_field_key not in self._attrs:
         #    return True
-        if db[self._table].find_one({'_id': self.get_id()}, ('_id')):
+        if self._persisted is not None:
+            return not self._persisted
+        if self._collection().find_one({'_id': self.get_id()}, ('_id')):
             return False
         return True
 
     def get_id(self):
         return getattr(self, self._primary_key)
 
-    def save(self, allow_fields=None):
-        """Save _attrs in to database.
+    def _raw_payload(self, allow_fields=None):
+        """Collect _attrs to a payload for database, without primary key.
 
-        :param list allow_fields: it will only save allow_fields.
+        :param list allow_fields: it will only collect allow_fields.
         """
-        cls = type(self)
         payload = {}
 
         fields = set(self._config.keys())
@@ -461,42 +1422,181 @@ class Base(object):
             #    pass  # pass if primary_key
             if k == self._primary_key:
                 continue
-            elif k in self._attrs:
-                payload[k] = self._attrs[k]
+            raw_field_key = self._config[k].raw_field_key
+            if raw_field_key in self._attrs:
+                payload[raw_field_key] = self._attrs[raw_field_key]
+        return payload
+
+    def _changes(self, allow_fields=None):
+        """Build the update operators of changed raw keys since load or last save.
+
+        :param list allow_fields: it will only collect allow_fields.
+        :return: (update, raw keys), update is empty if nothing changed.
+        """
+        keys = set(self._dirty or ())
+        for raw_field_key, origin in (self._origin or {}).iteritems():
+            if self._attrs.get(raw_field_key) != origin:
+                keys.add(raw_field_key)
+
+        raw_fields = {field.raw_field_key: field for field in self._config.itervalues()}
+        if allow_fields:
+            keys &= set(self._config[k].raw_field_key for k in allow_fields if k in self._config)
+        keys.discard(self._config[self._primary_key].raw_field_key)
+
+        update = {}
+        for raw_field_key in keys:
+            value = self._attrs[raw_field_key]
+            operators = None
+            if self._origin and raw_field_key in self._origin and raw_field_key in raw_fields:
+                operators = raw_fields[raw_field_key].diff(self._origin[raw_field_key], value)
+            if not operators:
+                operators = {'$set': {raw_field_key: value}}
+            for op, values in operators.iteritems():
+                update.setdefault(op, {}).update(values)
+        return update, keys
+
+    def _mark_saved(self, keys=None):
+        """Clean the changes of raw keys after save."""
+        if keys is None:
+            keys = set(self._attrs.keys())
+        if self._dirty:
+            self._dirty -= keys
+        for raw_field_key in keys:
+            if (self._origin and raw_field_key in self._origin) or isinstance(self._attrs.get(raw_field_key), list):
+                if self._origin is None:
+                    self._origin = {}
+                self._origin[raw_field_key] = _snapshot(self._attrs[raw_field_key])
+
+    def _prepare_save(self, allow_fields=None, force=False):
+        """Derive the values of fields before save, see `Field.prepare_save`.
+
+        :param list allow_fields: only derive from allow_fields.
+        :param bool force: derive even if the sources are not changed.
+        :return: allow_fields with the derived fields.
+        """
+        for field in self._prepare_fields:
+            if allow_fields and not set(field.sources) & set(allow_fields):
+                continue
+            if field.prepare_save(self, force) and allow_fields:
+                allow_fields = list(allow_fields) + [field.field_key]
+        return allow_fields
+
+    def _touch(self, raw_field_key):
+        """Mark a raw key is changed."""
+        if self._dirty is None:
+            self._dirty = set()
+        self._dirty.add(raw_field_key)
 
-        if self.is_new():
+    def save(self, allow_fields=None):
+        """Save _attrs in to database.
+
+        :param list allow_fields: it will only save allow_fields.
+        """
+        cls = type(self)
+        allow_fields = self._prepare_save(allow_fields)
+
+        if self._persisted is False:
+            payload = self._raw_payload(allow_fields)
             primary_field = self._config[self._primary_key]
             payload['_id'] = self._attrs[primary_field.raw_field_key]
             if cls._insert_one(payload):
+                self._persisted = True
+                self._mark_saved(set(payload))
+                return True
+
+        elif self._persisted:
+            update, keys = self._changes(allow_fields)
+            if not update:
+                return True
+            payload = update.pop('$set', None)
+            if cls._update_one({'_id': self.get_id()}, payload, update):
+                self._mark_saved(keys)
                 return True
 
         else:
-            if cls._update_one({'_id': self.get_id()}, payload):
+            # unknown where it come from, upsert it instead of query is_new() first.
+            payload = self._raw_payload(allow_fields)
+            if cls._upsert_one({'_id': self.get_id()}, payload):
+                self._persisted = True
+                self._mark_saved(set(payload) | {'_id'})
                 return True
         raise ModelSaveError('can not save instance of `%s`' % type(self))
 
+    def save_later(self, allow_fields=None):
+        """Save it after the view of current request returns a successful response, see `identity`.
+
+        :param list allow_fields: it will only save allow_fields.
+        """
+        return identity.save_later(self, allow_fields)
+
     def to_jsonify(self):
         """ return a dict, that can be dump to json.
         """
-        result = {
-            '__class__': type(self).__name__
-        }
-        for field_key, field in self._config.iteritems():
-            field.encode(self, result)
-        return result
+        return self._encoder(self)
 
 
-    def update_from_jsonify(self, payload, allow_fields=None):
-        """update a value from external dict by json.loads()."""
-        for field_key, field in self._config.iteritems():
+    def _decode(self, payload, allow_fields=None):
+        """Validate and set values from external dict in a single pass.
+
+        Nothing is set if any value is invalid, and all errors are raised together
+        by `ModelParserError`, its payload is like {'errors': {'birthday': '...'}}.
+
+        :param list allow_fields: only decode allow_fields, others are ignored.
+        """
+        decoders = self._decoders
+        if allow_fields is not None:
+            allow_fields = set(allow_fields)
+
+        values = []
+        fallbacks = []
+        errors = {}
+        for field_key, value in payload.iteritems():
+            if field_key not in decoders:
+                continue
+            if allow_fields is not None and field_key not in allow_fields:
+                continue
+
+            field, decode_value = decoders[field_key]
+            if decode_value is None:
+                fallbacks.append(field)
+            elif value is None:
+                values.append((field.raw_field_key, None))
+            else:
+                try:
+                    values.append((field.raw_field_key, decode_value(value)))
+                except (ValueError, TypeError, InvalidError) as e:
+                    errors[field_key] = '%s' % e
+
+        if errors:
+            raise ModelParserError('can not decode `%s`.' % type(self).__name__, payload={'errors': errors})
+
+        for raw_field_key, value in values:
+            self._attrs[raw_field_key] = value
+            self._touch(raw_field_key)
+        for field in fallbacks:
             field.decode(self, payload)
         return self
 
+    def update_from_jsonify(self, payload, allow_fields=None):
+        """update a value from external dict by json.loads().
+
+        :param list allow_fields: only update allow_fields, others are ignored.
+        """
+        return self._decode(payload, allow_fields)
+
     @classmethod
     def from_jsonify(cls, payload):
         if '__class__' in payload and payload['__class__'] == cls.__name__:
             instance = cls({})
-            for field_key, field in cls._config.iteritems():
-                field.decode(instance, payload)
-            return instance
+            return instance._decode(payload)
         raise ModelParserError('can not parse `%s` to `%s` instance.' % (payload, cls.__name__))
+
+
+def ensure_indexes(models=None):
+    """Ensure the declared indexes of models, all registered models if None.
+
+    :return dict: names of created indexes by model name.
+    """
+    if models is None:
+        models = Meta.registry.values()
+    return {model.__name__: model.ensure_indexes() for model in models}
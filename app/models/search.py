@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Search keys of text, for prefix and substring search by an index.
+
+A text is normalized (full-width to half-width, lower case, single space),
+then every substring becomes a key, and the prefixes of the text and of each
+word are kept again with `PREFIX`, so both can be answered by an equality
+query on a multikey index:
+
+.. code-block:: python
+
+    build_keys(u'Ｂｉｌｌ Lee')
+    # [u'^b', u'^bi', u'^bil', u'^bill', u'^bill ', ..., u'^l', u'^le', u'^lee',
+    #  u' ', u' l', ..., u'b', u'bi', u'bill', ..., u'lee']
+    query_key(u'BIL', prefix=True)  # u'^bil'
+"""
+
+import re
+import unicodedata
+
+# keys are not longer than this, longer terms are matched by the first chars.
+MAX_KEY_LENGTH = 10
+PREFIX = u'^'
+
+
+def normalize(text):
+    """Fold width by NFKC, lower case and collapse spaces."""
+    if not text:
+        return u''
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    text = unicodedata.normalize('NFKC', text).lower()
+    return u' '.join(text.split())
+
+
+def build_keys(*texts):
+    """Build the sorted search keys of texts."""
+    keys = set()
+    for text in texts:
+        text = normalize(text)
+        if not text:
+            continue
+
+        for word in set([text] + text.split(u' ')):
+            for end in xrange(1, min(len(word), MAX_KEY_LENGTH) + 1):
+                keys.add(PREFIX + word[:end])
+
+        for start in xrange(len(text)):
+            for end in xrange(start + 1, min(len(text), start + MAX_KEY_LENGTH) + 1):
+                keys.add(text[start:end])
+    return sorted(keys)
+
+
+def query_key(term, prefix=False):
+    """The key to find `term` by, None if the term is empty.
+
+    :param bool prefix: find the texts which have a word starting with term.
+    """
+    term = normalize(term)[:MAX_KEY_LENGTH]
+    if not term:
+        return None
+    return PREFIX + term if prefix else term
+
+
+def pattern(term):
+    """A regex to filter the texts by the whole term, for a term longer than the keys, match it with `i`.
+
+    It runs on the stored text, which is not normalized, so a full-width text is
+    not matched by a long half-width term.
+    """
+    term = normalize(term)
+    if not term:
+        return None
+    return u'\\s+'.join(re.escape(word) for word in term.split(u' '))
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Reports of persons by aggregation, materialized in the `stats_cache` collection.
+
+A report is computed once and read from `stats_cache` until it is older
+than `max_age`, or any person is written, see `invalidate`.
+
+.. code-block:: python
+
+    stats.get('gender', max_age=600)
+    # {'_id': 'gender', 'data': [{'key': 'female', 'count': 12}, ...], 'updated_at': datetime}
+"""
+
+import datetime
+
+from pymongo import WriteConcern
+
+from app.db import db
+from app.error import InvalidError
+from .models import Person
+
+COLLECTION = 'stats_cache'
+
+# (label, min age) from the oldest, see `age_pipeline`.
+AGE_BUCKETS = [
+    ('60+', 60),
+    ('45-59', 45),
+    ('30-44', 30),
+    ('18-29', 18),
+    ('12-17', 12),
+    ('0-11', 0),
+]
+
+REPORTS = {}
+
+
+def report(name):
+    """Register a function return the pipeline of a report."""
+    def decorator(func):
+        REPORTS[name] = func
+        return func
+    return decorator
+
+
+def _count_by(key):
+    """Count documents by the expression `key`, the result is like [{'key': .., 'count': ..}]."""
+    return [
+        {'$group': {'_id': key, 'count': {'$sum': 1}}},
+        {'$project': {'_id': False, 'key': '$_id', 'count': True}},
+        {'$sort': {'key': 1}},
+    ]
+
+
+def _years_ago(today, years):
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:
+        # Feb 29
+        return today.replace(year=today.year - years, day=28)
+
+
+@report('gender')
+def gender_pipeline(now):
+    return [{'$project': {'gender': True}}] + _count_by('$gender')
+
+
+@report('register_year')
+def register_year_pipeline(now):
+    return [
+        {'$match': {'register_date': {'$type': 'date'}}},
+        {'$project': {'register_date': True}},
+    ] + _count_by({'$year': '$register_date'})
+
+
+@report('baptize_priest')
+def baptize_priest_pipeline(now):
+    return [
+        {'$match': {'baptize_date': {'$type': 'date'}}},
+        {'$project': {'baptize_priest': True}},
+    ] + _count_by('$baptize_priest')
+
+
+@report('age')
+def age_pipeline(now):
+    """Count by the buckets of `AGE_BUCKETS`, the birthday is compared with the date of each bucket."""
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    bucket = 'unknown'
+    for label, age in reversed(AGE_BUCKETS):
+        bucket = {'$cond': [{'$lte': ['$birthday', _years_ago(today, age)]}, label, bucket]}
+    bucket = {'$cond': [{'$eq': [{'$ifNull': ['$birthday', None]}, None]}, 'unknown', bucket]}
+    return [{'$project': {'birthday': True}}] + _count_by(bucket)
+
+
+def get(name, max_age=600, refresh=False):
+    """Return the materialized report, compute it if not cached or older than max_age.
+
+    :param str name: one of `REPORTS`.
+    :param int max_age: seconds.
+    :param bool refresh: compute it even if cached.
+    """
+    if name not in REPORTS:
+        raise InvalidError('unknown stats `%s`, should be one of %s.' % (name, sorted(REPORTS)))
+
+    collection = db[COLLECTION]
+    now = datetime.datetime.utcnow()
+    if not refresh:
+        doc = collection.find_one({'_id': name})
+        if doc and doc['updated_at'] > now - datetime.timedelta(seconds=max_age):
+            return doc
+
+    pipeline = REPORTS[name](datetime.datetime.now())
+    doc = {
+        '_id': name,
+        'data': list(Person._collection().aggregate(pipeline)),
+        'updated_at': now,
+    }
+    collection.replace_one({'_id': name}, doc, upsert=True)
+    return doc
+
+
+def invalidate(model, ids=None):
+    """Drop all materialized reports, it does not wait for the acknowledgement."""
+    db[COLLECTION].with_options(write_concern=WriteConcern(w=0)).delete_many({})
+
+
+Person._write_hooks.append(invalidate)
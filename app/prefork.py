@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Pre-fork mode of `app.serve`, a master process and `SERVER_WORKERS` worker processes.
+
+The master binds the socket, then forks the workers, and each one serves it by
+its own gevent server and mongodb client. The master starts a new worker when
+one exits, ex: it dies, or stops itself after `WORKER_MAX_REQUESTS` requests or
+over `WORKER_MAX_MEMORY_MB` memory.
+
+The stats of workers are kept in a shared memory, so any worker can report
+all of them, see `workers()`.
+"""
+
+import mmap
+import os
+import resource
+import signal
+import struct
+import time
+
+from app.logger import logger
+
+# the stats of each worker in the shared memory.
+_SLOT_FIELDS = (
+    ('pid', 'q'),
+    ('requests', 'q'),
+    ('max_rss_kb', 'q'),
+    ('restarts', 'q'),
+    ('started_at', 'd'),
+)
+_SLOT_SIZE = struct.calcsize('=' + ''.join(fmt for _, fmt in _SLOT_FIELDS))
+
+_board = None
+
+
+class WorkerBoard(object):
+    """Stats of workers in an anonymous shared memory, it must be created before fork.
+
+    Each field is written alone, so the master and a worker can write the
+    different fields of a slot at the same time.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._mmap = mmap.mmap(-1, _SLOT_SIZE * size)
+        self._offsets = {}
+        offset = 0
+        for name, fmt in _SLOT_FIELDS:
+            self._offsets[name] = (offset, '=' + fmt)
+            offset += struct.calcsize('=' + fmt)
+
+    def set(self, slot, name, value):
+        offset, fmt = self._offsets[name]
+        struct.pack_into(fmt, self._mmap, slot * _SLOT_SIZE + offset, value)
+
+    def get(self, slot, name):
+        offset, fmt = self._offsets[name]
+        return struct.unpack_from(fmt, self._mmap, slot * _SLOT_SIZE + offset)[0]
+
+    def incr(self, slot, name):
+        self.set(slot, name, self.get(slot, name) + 1)
+
+    def stats(self):
+        return [
+            dict(((name, self.get(slot, name)) for name, _ in _SLOT_FIELDS), slot=slot)
+            for slot in xrange(self.size)
+        ]
+
+
+def workers():
+    """Stats of workers, an empty list if it is not in pre-fork mode."""
+    if _board is None:
+        return []
+    pid = os.getpid()
+    rows = _board.stats()
+    for row in rows:
+        row['current'] = row['pid'] == pid
+    return rows
+
+
+def _max_rss_kb():
+    # KB on linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _worker(slot, server, conf, master_signals):
+    """Serve in a forked worker until it is stopped or over a ceiling, then exit."""
+    import gevent
+    from app import db
+
+    for watcher in master_signals:
+        watcher.cancel()
+    # the client of master is not usable after fork.
+    db.reset()
+
+    max_requests = conf.get('WORKER_MAX_REQUESTS') or 0
+    max_rss_kb = (conf.get('WORKER_MAX_MEMORY_MB') or 0) * 1024
+    application = server.application
+
+    def counted(environ, start_response):
+        _board.incr(slot, 'requests')
+        return application(environ, start_response)
+    server.application = counted
+
+    def stop(reason):
+        if not server.closed:
+            logger.info('worker %s stop: %s', os.getpid(), reason)
+            server.close()
+
+    def monitor():
+        while not server.closed:
+            _board.set(slot, 'max_rss_kb', _max_rss_kb())
+            if max_requests and _board.get(slot, 'requests') >= max_requests:
+                stop('over %d requests' % max_requests)
+            elif max_rss_kb and _board.get(slot, 'max_rss_kb') >= max_rss_kb:
+                stop('over %d MB memory' % (max_rss_kb / 1024))
+            gevent.sleep(1)
+
+    gevent.signal(signal.SIGTERM, stop, 'SIGTERM')
+    # SIGINT of a terminal is sent to all processes, the master stops the workers by SIGTERM.
+    gevent.signal(signal.SIGINT, lambda: None)
+    gevent.spawn(monitor)
+    server.serve_forever(stop_timeout=conf.get('SERVER_STOP_TIMEOUT', 10))
+
+
+def run(server, conf):
+    """Run the master, and fork the workers serving `server`.
+
+    :param gevent.pywsgi.WSGIServer server: not started.
+    :param dict conf: the config.
+    """
+    global _board
+    import gevent
+    from app import db
+
+    size = conf.get('SERVER_WORKERS') or 0
+    if size < 1:
+        size = os.sysconf('SC_NPROCESSORS_ONLN')
+    _board = WorkerBoard(size)
+    stop_timeout = conf.get('SERVER_STOP_TIMEOUT', 10)
+
+    server.init_socket()
+    # the app may connect mongodb on init, never share the client with workers.
+    db.reset()
+
+    state = {'running': True}
+
+    def shutdown(signum):
+        logger.info('master receive signal %s, stop workers.', signum)
+        state['running'] = False
+
+    master_signals = [
+        gevent.signal(signal.SIGTERM, shutdown, signal.SIGTERM),
+        gevent.signal(signal.SIGINT, shutdown, signal.SIGINT),
+    ]
+
+    pids = {}
+
+    def fork(slot):
+        _board.set(slot, 'requests', 0)
+        _board.set(slot, 'max_rss_kb', 0)
+        _board.set(slot, 'started_at', time.time())
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _worker(slot, server, conf, master_signals)
+            except Exception as e:
+                logger.exception(e)
+                os._exit(1)
+            os._exit(0)
+        _board.set(slot, 'pid', pid)
+        pids[pid] = slot
+        logger.info('fork worker %s on slot %s', pid, slot)
+
+    for slot in xrange(size):
+        fork(slot)
+
+    while state['running']:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid and pid in pids:
+            slot = pids.pop(pid)
+            logger.info('worker %s exit with status %s, restart it.', pid, status)
+            if time.time() - _board.get(slot, 'started_at') < 1:
+                # do not restart a crashing worker in a busy loop.
+                gevent.sleep(1)
+            _board.incr(slot, 'restarts')
+            fork(slot)
+        else:
+            gevent.sleep(0.5)
+
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    deadline = time.time() + stop_timeout + 1
+    while pids and time.time() < deadline:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            pids.pop(pid, None)
+        else:
+            gevent.sleep(0.1)
+    for pid in pids:
+        logger.warning('kill worker %s after %ss.', pid, stop_timeout)
+        os.kill(pid, signal.SIGKILL)
+    server.close()
+    logger.info('master stopped.')
@@ -10,13 +10,17 @@ from flask import request, jsonify
 import app.config as config
 import app.utils as utils
 import app.auth as auth
+import app.prefork as prefork
 
 from app.logger import logger
+from app.db import pool_stats
 
 from app.error import InvalidError
 from app.auth import AuthManager
 from app.view import blueprint
-from app.models.models import Admin
+from app.models.models import Admin, Person, Group
+from app.models.identity import init_identity_map
+from app.models.orm import ensure_indexes
 
 
 class CustomFlask(Flask):
@@ -44,9 +48,13 @@ def main():
     main_app.url_map.converters['ObjectId'] = utils.ObjectIdConverter
 
     am = auth.init_auth(main_app)
+    init_identity_map(main_app)
 
     main_app.register_blueprint(blueprint)
 
+    if config.config.get('ENSURE_INDEXES_ON_STARTUP'):
+        ensure_indexes()
+
     # init admin
     admin = Admin.get_one('admin')
     if not admin:
@@ -146,6 +154,36 @@ def main():
             'data': am.me().to_jsonify()
         }
 
+    @main_app.route('/system/cache')
+    @am.login_required
+    def system_cache():
+        """Hit/miss counters of model caches."""
+        return {
+            'success': True,
+            'data': {
+                model.__name__: model._cache.stats()
+                for model in (Admin, Person, Group) if model._cache is not None
+            }
+        }
+
+    @main_app.route('/system/db')
+    @am.login_required
+    def system_db():
+        """Utilization of mongodb connection pools of this process."""
+        return {
+            'success': True,
+            'data': pool_stats()
+        }
+
+    @main_app.route('/system/workers')
+    @am.login_required
+    def system_workers():
+        """Stats of the server processes, empty if it is not in pre-fork mode."""
+        return {
+            'success': True,
+            'data': prefork.workers()
+        }
+
     @main_app.route('/error')
     def rasie_error():
         raise InvalidError('error', 400)
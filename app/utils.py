@@ -4,6 +4,7 @@ from werkzeug.routing import BaseConverter
 import json
 import bson
 import bson.json_util
+import flask
 
 
 class BSONJSONEncoder(json.JSONEncoder):
@@ -28,3 +29,55 @@ class ObjectIdConverter(BaseConverter):
 
     def to_url(self, value):
         return BaseConverter.to_url(value['$oid'])
+
+
+def stream_jsonify(rows, ndjson=False, buffer_size=64 * 1024, to_jsonify=None, **extra):
+    """Stream model instances as a chunked response, encode them one by one.
+
+    The body is same as a json response of ``{'success': True, 'data': [...], **extra}``,
+    or one json of ``to_jsonify()`` per line if ndjson, and the extra is at the last line.
+
+    :param rows: iterable of model instances, ex: FetchResult.
+    :param int buffer_size: flush to client when buffered bytes over it.
+    :param to_jsonify: function encode a row instead of `row.to_jsonify()`.
+    :param extra: other keys of response, callable value is called after all rows are sent,
+        ex: the token of next page.
+    """
+    encoder = BSONJSONEncoder()
+
+    def generate():
+        buf = []
+        size = 0
+        if not ndjson:
+            buf.append('{"success": true, "data": [')
+        for i, row in enumerate(rows):
+            chunk = encoder.encode(to_jsonify(row) if to_jsonify else row.to_jsonify())
+            if ndjson:
+                chunk += '\n'
+            elif i:
+                chunk = ',' + chunk
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                yield ''.join(buf)
+                buf = []
+                size = 0
+
+        tail = {}
+        for key, value in extra.iteritems():
+            tail[key] = value() if hasattr(value, '__call__') else value
+        if ndjson:
+            if tail:
+                buf.append(encoder.encode(tail) + '\n')
+        else:
+            buf.append(']')
+            for key, value in tail.iteritems():
+                buf.append(', %s: %s' % (encoder.encode(key), encoder.encode(value)))
+            buf.append('}')
+        yield ''.join(buf)
+
+    if ndjson:
+        mimetype = 'application/x-ndjson'
+    else:
+        mimetype = 'application/json'
+    return flask.Response(flask.stream_with_context(generate()), mimetype=mimetype)
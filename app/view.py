@@ -1,21 +1,55 @@
 # -*- coding: utf-8 -*-
-import re
-
 from flask import Blueprint#, render_template, abort
-from flask import request, jsonify
+from flask import request, jsonify, current_app
 from app.logger import logger
+from app.utils import stream_jsonify
 from app.error import InvalidError
 from app.models.models import Person, Group
+from app.models import stats
+from app.models import aio
 
 blueprint = Blueprint('view', __name__)
 
+
+def _request_fields():
+    """Parse `?fields=name,phone_0` for a sparse fieldset, None if not given."""
+    fields = request.values.get('fields', '')
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    return fields or None
+
+
+def _stream_result(result, to_jsonify=None):
+    """Stream a FetchResult, `?format=ndjson` for one json per line.
+
+    It is paginated if `?page_size=` or `?page_token=` is given, and `?sort=` is the
+    field key to sort. The response has `next_page_token` for next page.
+    `?with_total=1` to add `total` of the query.
+    """
+    extra = {}
+    page_size = request.values.get('page_size')
+    page_token = request.values.get('page_token')
+    if page_size or page_token:
+        try:
+            page_size = int(page_size or current_app.config.get('PAGE_SIZE', 50))
+        except ValueError:
+            raise InvalidError('`page_size` should be an integer.')
+        result = result.paginate(page_size, page_token, request.values.get('sort'))
+        extra['next_page_token'] = lambda: result.next_page_token
+
+    if request.values.get('with_total'):
+        extra['total'] = lambda: result.total
+
+    result.batch_size(current_app.config.get('STREAM_BATCH_SIZE', 200))
+    return stream_jsonify(result, ndjson=request.values.get('format') == 'ndjson', to_jsonify=to_jsonify, **extra)
+
+
 ######################
 #   Person
 ######################
 
 @blueprint.route('/person/one/<_id>')
 def person_one(_id):
-    person = Person.get_one(_id)
+    person = Person.get_one(_id, fields=_request_fields())
     return {
         'success': True,
         'data': person.to_jsonify()
@@ -41,8 +75,8 @@ def person_one_update(_id):
         'education',
         'job',
         'birthday',
-        'register_day',
-        'unregister_day',
+        'register_date',
+        'unregister_date',
         'baptize_date',
         'baptize_priest',
         'gifts',
@@ -64,38 +98,100 @@ def person_build_relation(_id):
     if 'rel' not in payload or 'person_id' not in payload:
         raise InvalidError('`rel` and `person_id` should in payload.')
 
+    Person.add_relation(_id, payload['rel'], payload['person_id'], due=True)
+    return {'success': True}
+
+
+@blueprint.route('/person/<_id>/overview')
+def person_overview(_id):
+    """The person with its groups and related persons, they are loaded concurrently."""
     person = Person.get_one(_id)
     if not person:
         raise InvalidError('Person(%s) is not existed.' % _id)
 
-    person.build_relation(payload['rel'], payload['person_id'], due=True)
-    return {'success': True}
+    groups, relations = aio.gather(
+        Group.aio.get_many(person.groups),
+        aio.spawn(person.get_relations, fields=_request_fields() or ['name']),
+        timeout=current_app.config.get('FANOUT_TIMEOUT', 10),
+    )
+    for row in relations:
+        row['person'] = row['person'] and row['person'].to_jsonify()
+    return {
+        'success': True,
+        'data': {
+            'person': person.to_jsonify(),
+            'groups': [group.to_jsonify() for group in groups if group],
+            'relations': relations,
+        }
+    }
+
+
+@blueprint.route('/person/<_id>/graph')
+def person_graph(_id):
+    person = Person.get_one(_id)
+    if not person:
+        raise InvalidError('Person(%s) is not existed.' % _id)
+
+    try:
+        depth = int(request.values.get('depth', 2))
+        max_nodes = int(request.values.get('max_nodes', 200))
+    except ValueError:
+        raise InvalidError('`depth` and `max_nodes` should be integer.')
+
+    return {
+        'success': True,
+        'data': person.relation_graph(depth, max_nodes)
+    }
+
+
+@blueprint.route('/person/search')
+def person_search():
+    term = request.values.get('term', '')
+    try:
+        limit = int(request.values.get('limit', 20))
+    except ValueError:
+        raise InvalidError('`limit` should be integer.')
+    limit = max(1, min(limit, 100))
+
+    persons = Person.search(term, limit, fields=_request_fields())
+    return {
+        'success': True,
+        'data': [person.to_jsonify() for person in persons]
+    }
+
+
+@blueprint.route('/person/upcoming')
+def person_upcoming():
+    """`?field=birthday&days=14` for the persons whose birthday is in the next 14 days."""
+    field = request.values.get('field', 'birthday')
+    if field not in ('birthday', 'baptize_date', 'register_date'):
+        raise InvalidError('`field` should be one of birthday, baptize_date, register_date.')
+    try:
+        days = int(request.values.get('days', 14))
+    except ValueError:
+        raise InvalidError('`days` should be integer.')
+
+    persons = Person.upcoming(field, max(1, min(days, 366)), fields=_request_fields())
+    return {
+        'success': True,
+        'data': [person.to_jsonify() for person in persons]
+    }
 
 
 @blueprint.route('/person/list')
 def person_list():
-    term = str(request.values.get('term', ''))
+    term = request.values.get('term', '')
     group = str(request.values.get('group', ''))
-    #limit = int(request.values.get('limit', 0))
-    #offset = int(request.values.get('offset', 0))
 
     query = {}
     if term:
-        query['name'] = {'$regex': re.escape(term), '$options': 'i'}
+        query.update(Person.search_query(term))
 
     if group:
-        pass
-        #query['name'] = {'$regex': re.escape(term), '$options': 'i'}
+        query['groups'] = group
 
-    result = Person.fetch(query)
-    data = []
-    for person in result:
-        data.append(person.to_jsonify())
-
-    return {
-        'success': True,
-        'data': data,
-    }
+    result = Person.fetch(query, fields=_request_fields())
+    return _stream_result(result)
 
 
 @blueprint.route('/person/create', methods=['POST'])
@@ -130,7 +226,11 @@ def group_one_update(_id):
         raise InvalidError('Group(%s) is not existed.' % _id)
 
     payload = request.json
-    group.update_from_jsonify(payload)
+    allow_field = (
+        'name',
+        'note'
+    )
+    group.update_from_jsonify(payload, allow_field)
     group.save()
 
     return {
@@ -141,7 +241,7 @@ def group_one_update(_id):
 
 @blueprint.route('/group/one/<_id>')
 def group_one(_id):
-    group = Group.get_one(_id)
+    group = Group.get_one(_id, fields=_request_fields())
     return {
         'success': True,
         'data': group.to_jsonify()
@@ -150,12 +250,35 @@ def group_one(_id):
 
 @blueprint.route('/group/list')
 def group_list():
-    result = Group.fetch()
-    data = []
-    for group in result:
-        data.append(group.to_jsonify())
+    """`?with_counts=1` to add `member_count` of each group."""
+    result = Group.fetch(fields=_request_fields())
+    if not request.values.get('with_counts'):
+        return _stream_result(result)
+
+    counts = Group.member_counts()
 
+    def to_jsonify(group):
+        row = group.to_jsonify()
+        row['member_count'] = counts.get(group.get_id(), 0)
+        return row
+    return _stream_result(result, to_jsonify)
+
+
+######################
+#   stats
+######################
+
+
+@blueprint.route('/stats/<name>')
+def stats_one(name):
+    """`?refresh=1` to compute it again."""
+    doc = stats.get(
+        name,
+        max_age=current_app.config.get('STATS_REFRESH_INTERVAL', 600),
+        refresh=bool(request.values.get('refresh'))
+    )
     return {
         'success': True,
-        'data': data,
+        'data': doc['data'],
+        'updated_at': doc['updated_at']
     }
@@ -7,11 +7,62 @@ config = {
     'DB_PORT': 27017,
     'DB_NAME': 'church',
 
+    # options of MongoClient, None for the default of pymongo, see `app.db.CLIENT_OPTIONS`.
+    # size the pool by the concurrent requests of a process, ex: SERVER_POOL_SIZE.
+    'DB_MAX_POOL_SIZE': None,
+    'DB_MIN_POOL_SIZE': None,
+    'DB_MAX_IDLE_TIME_MS': None,
+    'DB_WAIT_QUEUE_TIMEOUT_MS': None,
+    'DB_WAIT_QUEUE_MULTIPLE': None,
+    'DB_CONNECT_TIMEOUT_MS': None,
+    'DB_SOCKET_TIMEOUT_MS': None,
+    'DB_SERVER_SELECTION_TIMEOUT_MS': None,
+    'DB_COMPRESSORS': None,
+    'DB_READ_PREFERENCE': None,
+    'DB_READ_CONCERN_LEVEL': None,
+    'DB_W': None,
+    'DB_WTIMEOUT_MS': None,
+    'DB_JOURNAL': None,
+    # other clients by name, each one overrides the options above, see `app.db.get_db`.
+    # bulk writes of models use 'bulk' if it is declared.
+    'DB_CLIENTS': {},
+
     'DEFAULT_ADMIN_USERNAME': 'admin',
     'DEFAULT_ADMIN_PASSWORD': '1234',
 
     'JWT_SECRET': '1&2,s@#sa;jd9',
-    'JWT_EXPIRE': 86400
+    'JWT_EXPIRE': 86400,
+
+    # documents per cursor batch when stream a list response.
+    'STREAM_BATCH_SIZE': 200,
+    # default page size of list response if paginated by `page_token`.
+    'PAGE_SIZE': 50,
+
+    # create the missing indexes declared on models when server start,
+    # or run `scripts/ensure-indexes.sh` on deploy instead.
+    'ENSURE_INDEXES_ON_STARTUP': True,
+
+    # seconds a report of /stats/<name> is cached in `stats_cache`, it is dropped on write of persons.
+    'STATS_REFRESH_INTERVAL': 600,
+
+    # seconds to wait for the concurrent queries of an endpoint, ex: /person/<_id>/overview.
+    'FANOUT_TIMEOUT': 10,
+
+    # production server of `app.serve`.
+    'SERVER_HOST': '0.0.0.0',
+    'SERVER_PORT': 5000,
+    # max requests handled concurrently by greenlets.
+    'SERVER_POOL_SIZE': 1000,
+    # max connections wait in the listen queue when the pool is full.
+    'SERVER_BACKLOG': 1024,
+    # seconds to wait for the running requests on SIGTERM / SIGINT.
+    'SERVER_STOP_TIMEOUT': 10,
+    'SERVER_ACCESS_LOG': False,
+    # processes of the server, 0 for the number of CPU, see `app.prefork`.
+    'SERVER_WORKERS': 1,
+    # a worker is restarted after these requests, or over this memory, 0 for no limit.
+    'WORKER_MAX_REQUESTS': 0,
+    'WORKER_MAX_MEMORY_MB': 0,
 }
 
 
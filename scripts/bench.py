@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Micro benchmarks of the model layer, they do not need a running mongodb.
+
+    PYTHONPATH=./ python scripts/bench.py instances -n 100000
+    PYTHONPATH=./ python scripts/bench.py encode -n 100000
+    PYTHONPATH=./ python scripts/bench.py collection -n 100000
+
+and the throughput of a running server, see `app.serve`:
+
+    PYTHONPATH=./ python scripts/bench.py http --url http://127.0.0.1:5000/ -c 50 -n 5000
+"""
+
+import argparse
+import datetime
+import gc
+import resource
+import time
+
+
+def maxrss():
+    """Peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def make_person_raw(i):
+    """A raw document like what pymongo decodes from the `persons` collection."""
+    return {
+        '_id': 'person-%08d' % i,
+        'social_id': 'A%09d' % i,
+        'name': u'Person %d' % i,
+        'birthday': datetime.datetime(1980 + i % 30, 1 + i % 12, 1 + i % 28),
+        'gender': 'male' if i % 2 else 'female',
+        'phone_0': '0988-%06d' % i,
+        'phone_1': '',
+        'phone_2': '',
+        'address_0': u'No.%d, Some Road' % i,
+        'address_1': '',
+        'email_0': 'person%d@example.com' % i,
+        'email_1': '',
+        'education': '',
+        'job': '',
+        'register_date': datetime.datetime(2010, 1 + i % 12, 1),
+        'baptize_date': datetime.datetime(2011, 1 + i % 12, 1),
+        'baptize_priest': 'Priest %d' % (i % 10),
+        'gifts': [],
+        'groups': ['group-%d' % (i % 20)],
+        'events': [{'date': '2016-01-01', 'title': 'event'}],
+        'relations': [],
+        'note': '',
+    }
+
+
+def bench_instances(args):
+    """Build `n` Person instances from raw documents and read their fields."""
+    from app.models import identity
+    from app.models.models import Person
+
+    raws = [make_person_raw(i) for i in xrange(args.n)]
+    gc.collect()
+    rss = maxrss()
+
+    start = time.time()
+    persons = [Person.get_one(raw=raw) for raw in raws]
+    build = time.time() - start
+
+    start = time.time()
+    for person in persons:
+        person.name
+        person.phone_0
+        person.groups
+    access = time.time() - start
+
+    print 'build %d Person: %.3fs (%.2fus each)' % (args.n, build, build * 1e6 / args.n)
+    print 'read 3 fields: %.3fs (%.2fus each)' % (access, access * 1e6 / args.n)
+    print 'memory of instances: %.1f MB' % (maxrss() - rss)
+
+    # the rows of `fetch`, the identity map is looked up once for all of them.
+    identity_map = identity.current()
+    start = time.time()
+    for raw in raws:
+        Person._load(raw, track=False, identity_map=identity_map)
+    rows = time.time() - start
+    print 'load %d rows like fetch: %.3fs (%.2fus each)' % (args.n, rows, rows * 1e6 / args.n)
+
+
+def bench_encode(args):
+    """Encode Person instances by `to_jsonify`, compared with calling `Field.encode` one by one."""
+    from app.models.models import Person
+
+    persons = [Person.get_one(raw=make_person_raw(i)) for i in xrange(args.n)]
+
+    def generic(instance):
+        result = {'__class__': type(instance).__name__}
+        for field in instance._config.itervalues():
+            field.encode(instance, result)
+        return result
+
+    start = time.time()
+    for person in persons:
+        generic(person)
+    before = time.time() - start
+
+    start = time.time()
+    for person in persons:
+        person.to_jsonify()
+    after = time.time() - start
+
+    print 'Field.encode per field: %.3fs (%.2fus each)' % (before, before * 1e6 / args.n)
+    print 'compiled to_jsonify:    %.3fs (%.2fus each)' % (after, after * 1e6 / args.n)
+
+
+def bench_collection(args):
+    """Resolve the collection of Person per query, by `db[...]` compared with `Person._collection()`.
+
+    The client does not connect before a query is sent, so it needs no mongodb.
+    """
+    import app.config as config
+    from app.db import db
+    from app.models.models import Person
+
+    config.load_config()
+
+    start = time.time()
+    for _ in xrange(args.n):
+        db[Person._table]
+    before = time.time() - start
+
+    start = time.time()
+    for _ in xrange(args.n):
+        Person._collection()
+    after = time.time() - start
+
+    print 'db[Person._table]:    %.3fs (%.2fus each)' % (before, before * 1e6 / args.n)
+    print 'Person._collection(): %.3fs (%.2fus each)' % (after, after * 1e6 / args.n)
+
+
+def bench_http(args):
+    """Send `n` GET requests by `c` concurrent keep-alive connections."""
+    from gevent import monkey
+    monkey.patch_all()
+    import httplib
+    import urlparse
+    import gevent.pool
+
+    url = urlparse.urlsplit(args.url)
+    path = url.path or '/'
+    if url.query:
+        path += '?' + url.query
+    latencies = []
+    errors = [0]
+
+    def worker(n):
+        conn = httplib.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        for _ in xrange(n):
+            start = time.time()
+            try:
+                conn.request('GET', path)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status >= 500:
+                    errors[0] += 1
+            except Exception:
+                errors[0] += 1
+                conn.close()
+                conn = httplib.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            latencies.append(time.time() - start)
+        conn.close()
+
+    pool = gevent.pool.Pool(args.c)
+    start = time.time()
+    for i in xrange(args.c):
+        pool.spawn(worker, args.n // args.c + (1 if i < args.n % args.c else 0))
+    pool.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    print '%d requests, %d concurrent, %d errors in %.3fs' % (len(latencies), args.c, errors[0], elapsed)
+    print 'throughput: %.1f req/s' % (len(latencies) / elapsed)
+    print 'latency p50: %.2fms, p99: %.2fms' % (
+        latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks of the model layer.')
+    subparsers = parser.add_subparsers()
+
+    p = subparsers.add_parser('instances', help='build and read Person instances.')
+    p.add_argument('-n', type=int, default=100000)
+    p.set_defaults(func=bench_instances)
+
+    p = subparsers.add_parser('encode', help='encode Person instances by to_jsonify.')
+    p.add_argument('-n', type=int, default=100000)
+    p.set_defaults(func=bench_encode)
+
+    p = subparsers.add_parser('collection', help='resolve the collection of a model per query.')
+    p.add_argument('-n', type=int, default=100000)
+    p.set_defaults(func=bench_collection)
+
+    p = subparsers.add_parser('http', help='throughput of a running server.')
+    p.add_argument('--url', default='http://127.0.0.1:5000/')
+    p.add_argument('-c', type=int, default=50, help='concurrent connections.')
+    p.add_argument('-n', type=int, default=5000, help='total requests.')
+    p.set_defaults(func=bench_http)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    args.func(args)
@@ -0,0 +1,5 @@
+#!/bin/bash
+
+DIR="$(cd "$(dirname "$0")/.." && pwd)"
+source ${DIR}/venv/bin/activate
+PYTHONPATH=${DIR} python -m app.manage ensure_indexes "$@"
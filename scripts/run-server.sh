@@ -0,0 +1,6 @@
+#!/bin/bash
+
+DIR="$(cd "$(dirname "$0")/.." && pwd)"
+echo ${DIR}
+source ${DIR}/venv/bin/activate
+PYTHONPATH=${DIR} exec python -m app.serve "$@"
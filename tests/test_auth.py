@@ -95,6 +95,18 @@ class TestServer(unittest.TestCase):
         result = json.loads(r.data)['data']
         self.assertEqual(result['admin_id'], 'john')
 
+        r = self.client.get('/system/cache')
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('hits', json.loads(r.data)['data']['Admin'])
+
+        r = self.client.get('/system/db')
+        self.assertEqual(r.status_code, 200)
+        self.assertIn('default', json.loads(r.data)['data'])
+
+        r = self.client.get('/system/workers')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(json.loads(r.data)['data'], [])
+
     def test_unauth(self):
         """Test unauth."""
 
@@ -6,6 +6,7 @@ import unittest
 
 from app.config import config
 from app.db import db
+from app.error import InvalidError
 from app.models.models import Person
 from app.models.models import Group
 
@@ -50,6 +51,10 @@ class TestModel(unittest.TestCase):
             'name': 'Mary'
         })
         p.build_relation('family', p_other.get_id(), due=True)
+        self.assertIn({'rel': 'family', 'person_id': p_other.get_id()}, p.relations)
+        self.assertEqual(p._changes()[0], {})
+        with self.assertRaises(InvalidError):
+            p.build_relation('family', p_other.get_id())
 
         p = Person.get_one(p.get_id())
         self.assertIn({
@@ -63,6 +68,34 @@ class TestModel(unittest.TestCase):
             'person_id': p.get_id()
         }, p_other.relations)
 
+        # the reverse relation is existed, it succeeds by pushing this side.
+        p_third = Person.create({'name': 'Tom'})
+        db.persons.update_one({'_id': p_third.get_id()}, {'$push': {'relations': {'rel': 'friend', 'person_id': p.get_id()}}})
+        p_third = Person.get_one(p_third.get_id())
+        p_third.build_relation('friend', p.get_id(), due=True)
+        self.assertEqual(p_third.relations, [{'rel': 'friend', 'person_id': p.get_id()}])
+        self.assertIn({'rel': 'friend', 'person_id': p_third.get_id()}, Person.get_one(p.get_id()).relations)
+
+        # the other person is not existed, this side is pushed and kept in memory.
+        with self.assertRaises(InvalidError) as ctx:
+            p_third.build_relation('friend', 'not-existed', due=True)
+        self.assertEqual(ctx.exception.payload, {'written': [p_third.get_id()]})
+        self.assertIn({'rel': 'friend', 'person_id': 'not-existed'}, p_third.relations)
+        self.assertEqual(p_third.relations, db.persons.find_one({'_id': p_third.get_id()})['relations'])
+        db.persons.delete_one({'_id': p_third.get_id()})
+        db.persons.update_one({'_id': p.get_id()}, {'$pull': {'relations': {'person_id': p_third.get_id()}}})
+
+        p = Person.get_one(p.get_id())
+        relations = p.get_relations()
+        self.assertEqual(len(relations), 1)
+        self.assertEqual(relations[0]['rel'], 'family')
+        self.assertEqual(relations[0]['person'].name, 'Mary')
+
+        persons = Person.get_many([p_other.get_id(), 'not-existed', p.get_id()], fields=['name'])
+        self.assertEqual(persons[0].name, 'Mary')
+        self.assertIsNone(persons[1])
+        self.assertEqual(persons[2].name, 'Bill')
+
         # test fetch
         fetch_result = Person.fetch()
         self.assertEqual(fetch_result.total, 2)
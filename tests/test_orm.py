@@ -8,9 +8,9 @@ from collections import namedtuple
 import unittest
 from app.config import config
 from app.db import db
-from app.models import ModelError, ModelInvaldError, ModelDeclareError
-from app.models import Meta, Base, ClassReadonlyProperty
-from app.models import Field, IDField, StringField, BoolField, IntField, DateField, ListField, TupleField
+from app.models import ModelError, ModelInvaldError, ModelDeclareError, ModelSaveError, ModelParserError
+from app.models import Meta, Base, ClassReadonlyProperty, LRUCache
+from app.models import Field, IDField, StringField, BoolField, IntField, DateField, ListField, TupleField, SearchField
 
 
 class TestDB(unittest.TestCase):
@@ -26,6 +26,60 @@ class TestDB(unittest.TestCase):
 
         db.tests.insert_one({'_id': '_id', 'a': 'A', 'b': 'B', 'c': 'c'})
 
+    def test_db_reset(self):
+        """Test the client is created again after reset or fork."""
+        import app.db
+        import app.models.orm as orm
+
+        app.db.find_db()
+        # `_init_db` is mocked in tests/__init__.py
+        count = app.db._init_db.call_count
+        app.db.find_db()
+        self.assertEqual(app.db._init_db.call_count, count)
+        # as if in a forked process.
+        app.db._pid = -1
+        app.db.find_db()
+        self.assertEqual(app.db._init_db.call_count, count + 1)
+        self.assertEqual(app.db._pid, os.getpid())
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+            _id = IDField()
+
+        collection = Foo._collection()
+        self.assertIs(Foo._collection(), collection)
+
+        app.db.reset()
+        self.assertIsNone(app.db._db)
+        # resolved again by the new client.
+        generation = app.db.generation()
+        Foo._collection()
+        self.assertEqual(orm._collections[Foo][0], generation)
+        db.tests.insert_one({'name': 'test-name'})
+        self.assertEqual(db.tests.find_one({'name': 'test-name'})['name'], 'test-name')
+
+    def test_db_clients(self):
+        """Test the options of MongoClient from config, and the named clients."""
+        import mock
+        import app.db
+
+        with mock.patch.dict(config, {'DB_MAX_POOL_SIZE': 20, 'DB_W': None}):
+            options = app.db.client_options({'DB_SOCKET_TIMEOUT_MS': 1000})
+        self.assertEqual(options, {'maxPoolSize': 20, 'socketTimeoutMS': 1000})
+
+        # not declared, same as default.
+        self.assertIs(app.db.get_db('bulk'), app.db.find_db())
+
+        with mock.patch.dict(config, {'DB_CLIENTS': {'bulk': {'DB_JOURNAL': False}}}), \
+                mock.patch('pymongo.MongoClient') as client_cls:
+            bulk_db = app.db.get_db('bulk')
+            self.assertIs(app.db.get_db('bulk'), bulk_db)
+            self.assertEqual(client_cls.call_count, 1)
+            self.assertFalse(client_cls.call_args[1]['j'])
+            self.assertIn('bulk', app.db.pool_stats())
+        app.db._named.clear()
+
     def test_operator(self):
         """ Test declare a ModelClass. """
         Point = namedtuple('Point', ['x', 'y'], False)
@@ -64,6 +118,7 @@ class TestDB(unittest.TestCase):
 
         foo = Foo.create({'str_field': 'any string'})
         self.assertFalse(foo.is_new())
+        self.assertTrue(foo._persisted)
         self.assertIsNotNone(foo.foo_id)
         self.assertEqual(foo.str_field, 'any string')
         self.assertEqual(foo.int_field, 0)
@@ -146,6 +201,26 @@ class TestDB(unittest.TestCase):
         self.assertEqual(_foo['tuple_field'], {'x': 1, 'y': 2})
         self.assertEqual(_foo['list_field'], [])
 
+        class UpperField(StringField):
+            def value_out(self, instance, value):
+                return value.upper()
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('foo_id')
+
+            foo_id = IDField('_id')
+            upper_field = UpperField()
+            date_field = DateField()
+
+        foo = Foo({'foo_id': 'id_0', 'upper_field': 'abc', 'date_field': datetime.date(1850, 1, 2)})
+        self.assertEqual(foo.to_jsonify(), {
+            '__class__': 'Foo',
+            'foo_id': 'id_0',
+            'upper_field': 'ABC',
+            'date_field': '1850-01-02',
+        })
+
 
     def test_jsonify_decode(self):
         """ Test jsonify decode from dict for json loads."""
@@ -184,6 +259,26 @@ class TestDB(unittest.TestCase):
         Point = namedtuple('Point', ['x', 'y'], False)
         self.assertEqual(foo.tuple_field, Point(x=1, y=2))
 
+        foo.update_from_jsonify({
+            'foo_id': 'other',
+            'str_field': 'update',
+            'date_field': '2015-01-02',
+        }, allow_fields=('str_field', 'date_field'))
+        self.assertEqual(foo.foo_id, '1234')
+        self.assertEqual(foo.str_field, 'update')
+        self.assertEqual(foo.date_field, datetime.date(2015, 1, 2))
+
+        with self.assertRaises(ModelParserError) as ctx:
+            foo.update_from_jsonify({
+                'str_field': 'invalid',
+                'int_field': 'abc',
+                'date_field': '2015-13-45',
+                'bool_field': 'yes',
+                'list_field': 1,
+            })
+        self.assertItemsEqual(ctx.exception.payload['errors'].keys(), ['int_field', 'date_field', 'bool_field', 'list_field'])
+        self.assertEqual(foo.str_field, 'update')
+
     def test_declare_error(self):
         """ Test by error case."""
 
@@ -244,3 +339,435 @@ class TestDB(unittest.TestCase):
         r = Foo.fetch({'name': 'John'})
         self.assertEqual(r.total, 1)
         self.assertEqual(r[0].name, 'John')
+
+        # total is cached until write by model.
+        db.foos.insert_one({'_id': 'id_4', 'name': 'John', 'age': 50})
+        self.assertEqual(Foo.fetch({'name': 'John'}).total, 1)
+        self.assertEqual(Foo.count({}), 4)
+        Foo.create({'_id': 'id_5', 'name': 'Ken'})
+        self.assertEqual(Foo.fetch({'name': 'John'}).total, 2)
+        self.assertEqual(Foo.count({}), 6)
+
+        r = Foo.fetch({'_id': 'id_1'}, fields=['name'])
+        foo = r[0]
+        self.assertEqual(foo.to_jsonify(), {'__class__': 'Foo', '_id': 'id_1', 'name': 'John'})
+        with self.assertRaises(ModelInvaldError):
+            foo.age
+        foo.name = 'John-update'
+        foo.save()
+        self.assertEqual(db.foos.find_one({'_id': 'id_1'}), {'_id': 'id_1', 'name': 'John-update', 'age': 30})
+
+        foo = Foo.get_one('id_2', fields=['age'])
+        self.assertEqual(foo.age, 20)
+        self.assertNotIn('name', foo._attrs)
+
+        with self.assertRaises(ModelInvaldError):
+            Foo.fetch({}, fields=['other'])
+
+    def test_bulk(self):
+        """Test bulk_create and bulk_save."""
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+
+            _id = IDField()
+            name = StringField()
+            age = IntField(default=18)
+
+        result = Foo.bulk_create([
+            {'_id': 'id_0', 'name': 'Bill'},
+            {'_id': 'id_1', 'name': 'John', 'age': 30},
+            {'_id': 'id_2', 'name': 'Mary'},
+        ], batch_size=2)
+        self.assertTrue(result.success)
+        self.assertEqual(result.inserted_count, 3)
+        self.assertEqual(db.foos.find_one({'_id': 'id_0'})['age'], 18)
+        self.assertEqual(db.foos.find_one({'_id': 'id_1'})['age'], 30)
+
+        result = Foo.bulk_create([
+            {'_id': 'id_3', 'name': 'Tommy'},
+            {'_id': 'id_0', 'name': 'Duplicated'},
+            {'_id': 'id_4', 'other': 'other'},
+            {'_id': 'id_5', 'name': 'Ken'},
+        ], ordered=False)
+        self.assertEqual(result.inserted_count, 2)
+        self.assertItemsEqual([err['index'] for err in result.errors], [1, 2])
+        self.assertIsNone(result.instances[2])
+        self.assertEqual(db.foos.count(), 5)
+
+        foos = list(Foo.fetch({}))
+        for foo in foos:
+            foo.age = 50
+        foos.append(Foo({'_id': 'id_7', 'name': 'New'}))
+        result = Foo.bulk_save(foos, batch_size=2)
+        self.assertTrue(result.success)
+        self.assertEqual(result.matched_count, 5)
+        self.assertEqual(result.upserted_count, 1)
+        self.assertFalse(foos[-1].is_new())
+        self.assertEqual(db.foos.find({'age': 50}).count(), 5)
+        self.assertEqual(db.foos.find_one({'_id': 'id_7'})['name'], 'New')
+
+        # the write concern is not satisfied, but the documents are written.
+        import mock
+        from pymongo.errors import BulkWriteError
+        error = BulkWriteError({
+            'nInserted': 1, 'writeErrors': [],
+            'writeConcernErrors': [{'code': 64, 'errmsg': 'waiting for replication timed out'}],
+        })
+        for ordered in (True, False):
+            with mock.patch.object(type(db.foos), 'bulk_write', side_effect=error) as bulk_write:
+                result = Foo.bulk_create([{'_id': 'id_8_%s_%d' % (ordered, i), 'name': 'Ken'} for i in range(3)],
+                                         ordered=ordered, batch_size=1)
+            # every batch is sent.
+            self.assertEqual(bulk_write.call_count, 3)
+            self.assertFalse(result.success)
+            self.assertEqual(result.errors, [{'index': None, 'code': 64, 'message': 'waiting for replication timed out'}] * 3)
+            self.assertEqual([instance._persisted for instance in result.instances], [True] * 3)
+
+    def test_persisted(self):
+        """Test save by persisted state without query is_new."""
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+
+            _id = IDField()
+            name = StringField()
+
+        foo = Foo.create({'_id': 'id_0', 'name': 'Bill'})
+        self.assertTrue(foo._persisted)
+
+        foo = Foo.get_one('id_0')
+        self.assertTrue(foo._persisted)
+        foo.name = 'John'
+        foo.save()
+        self.assertEqual(db.foos.find_one({'_id': 'id_0'})['name'], 'John')
+
+        self.assertTrue(Foo.fetch({})[0]._persisted)
+
+        foo = Foo.from_jsonify({'__class__': 'Foo', '_id': 'id_1', 'name': 'Mary'})
+        self.assertIsNone(foo._persisted)
+        foo.save()
+        self.assertTrue(foo._persisted)
+        self.assertEqual(db.foos.find_one({'_id': 'id_1'})['name'], 'Mary')
+
+        foo = Foo.from_jsonify({'__class__': 'Foo', '_id': 'id_1', 'name': 'Tommy'})
+        foo.save()
+        self.assertEqual(db.foos.find({'_id': 'id_1'}).count(), 1)
+        self.assertEqual(db.foos.find_one({'_id': 'id_1'})['name'], 'Tommy')
+
+        db.foos.delete_one({'_id': 'id_0'})
+        foo = Foo({'_id': 'id_0', 'name': 'Ken'})
+        foo._persisted = True
+        with self.assertRaises(ModelSaveError):
+            foo.save()
+
+    def test_dirty(self):
+        """Test save only changed fields."""
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+
+            _id = IDField()
+            name = StringField()
+            note = StringField()
+            tags = ListField(incremental=True)
+            items = ListField()
+
+        Foo.create({'_id': 'id_0', 'name': 'Bill', 'tags': ['a', 'b'], 'items': [1]})
+
+        foo = Foo.get_one('id_0')
+        self.assertEqual(foo._changes(), ({}, set()))
+        foo.note = 'note'
+        self.assertEqual(foo._changes(), ({'$set': {'note': 'note'}}, {'note'}))
+
+        # only `note` is saved, the `name` changed by other is kept.
+        db.foos.update_one({'_id': 'id_0'}, {'$set': {'name': 'John'}})
+        foo.save()
+        raw = db.foos.find_one({'_id': 'id_0'})
+        self.assertEqual(raw['name'], 'John')
+        self.assertEqual(raw['note'], 'note')
+
+        # nothing changed, skip write.
+        db.foos.update_one({'_id': 'id_0'}, {'$set': {'note': 'other'}})
+        self.assertTrue(foo.save())
+        self.assertEqual(db.foos.find_one({'_id': 'id_0'})['note'], 'other')
+
+        # modify list in place.
+        foo.items.append(2)
+        foo.tags.append('c')
+        update, keys = foo._changes()
+        self.assertEqual(update, {
+            '$set': {'items': [1, 2]},
+            '$push': {'tags': {'$each': ['c']}}
+        })
+        db.foos.update_one({'_id': 'id_0'}, {'$push': {'tags': 'x'}})
+        foo.save()
+        self.assertEqual(db.foos.find_one({'_id': 'id_0'})['tags'], ['a', 'b', 'x', 'c'])
+        self.assertEqual(foo._changes(), ({}, set()))
+
+        foo.tags.remove('a')
+        self.assertEqual(foo._changes()[0], {'$pull': {'tags': {'$in': ['a']}}})
+        foo.save()
+        self.assertEqual(db.foos.find_one({'_id': 'id_0'})['tags'], ['b', 'x', 'c'])
+
+        foo.tags = ['z']
+        self.assertEqual(foo._changes()[0], {'$set': {'tags': ['z']}})
+        foo.note = 'note-2'
+        foo.save(allow_fields=('note',))
+        self.assertEqual(foo._changes()[0], {'$set': {'tags': ['z']}})
+
+        # a default filled on read is not a change, unless it is modified in place.
+        db.foos.insert_one({'_id': 'id_1', 'name': 'Mary'})
+        foo = Foo.get_one('id_1')
+        self.assertEqual(foo.tags, [])
+        self.assertEqual(foo.items, [])
+        self.assertEqual(foo._changes(), ({}, set()))
+        foo.tags.append('a')
+        self.assertEqual(foo._changes()[0], {'$push': {'tags': {'$each': ['a']}}})
+        foo.save()
+        self.assertEqual(db.foos.find_one({'_id': 'id_1'}), {'_id': 'id_1', 'name': 'Mary', 'tags': ['a']})
+
+    def test_paginate(self):
+        """Test keyset pagination of FetchResult."""
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+
+            _id = IDField()
+            name = StringField()
+            age = IntField()
+
+        db.foos.insert_many([{'_id': 'id_%d' % i, 'name': 'name-%d' % (i % 3), 'age': i} for i in range(10)])
+
+        page = Foo.fetch({'age': {'$gte': 2}}).paginate(3)
+        ids = []
+        while page:
+            rows = list(page)
+            self.assertTrue(len(rows) <= 3)
+            ids.extend(foo._id for foo in rows)
+            page = page.next_page()
+        self.assertEqual(ids, ['id_%d' % i for i in range(2, 10)])
+
+        page = Foo.fetch({}, fields=['age']).paginate(4, sort_key='name')
+        rows = list(page)
+        self.assertEqual([foo._id for foo in rows], ['id_0', 'id_3', 'id_6', 'id_9'])
+        self.assertNotIn('name', rows[0].to_jsonify())
+
+        page = Foo.fetch({}).paginate(4, page_token=page.next_page_token)
+        self.assertEqual([foo._id for foo in page], ['id_1', 'id_4', 'id_7', 'id_2'])
+
+        with self.assertRaises(ModelInvaldError):
+            Foo.fetch({}).paginate(4, page_token='invalid')
+
+        with self.assertRaises(ModelInvaldError):
+            Foo.fetch({}).paginate(4, sort_key='other')
+
+    def test_cache(self):
+        """Test read-through cache of get_one."""
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+            _cache = LRUCache(maxsize=2, ttl=60)
+
+            _id = IDField()
+            name = StringField()
+
+        db.foos.insert_many([{'_id': 'id_%d' % i, 'name': 'name-%d' % i} for i in range(3)])
+
+        foo = Foo.get_one('id_0')
+        self.assertEqual(Foo._cache.stats()['misses'], 1)
+        foo.name = 'changed-without-save'
+        self.assertEqual(Foo.get_one('id_0').name, 'name-0')
+        self.assertEqual(Foo._cache.stats()['hits'], 1)
+
+        # stale until write by model.
+        db.foos.update_one({'_id': 'id_0'}, {'$set': {'name': 'other'}})
+        self.assertEqual(Foo.get_one('id_0').name, 'name-0')
+        foo = Foo.get_one('id_0')
+        foo.name = 'saved'
+        foo.save()
+        self.assertEqual(Foo.get_one('id_0').name, 'saved')
+
+        Foo.get_one('id_1')
+        Foo.get_one('id_2')
+        self.assertEqual(len(Foo._cache), 2)
+        self.assertEqual(Foo._cache.stats()['evictions'], 1)
+        self.assertIsNone(Foo.get_one('id_none'))
+
+    def test_indexes(self):
+        """Test create the indexes declared on model."""
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+            _indexes = ClassReadonlyProperty([
+                {'keys': [('name', 1), ('code', -1)], 'name': 'name_code'},
+            ])
+
+            _id = IDField()
+            name = StringField(index=True)
+            code = StringField(raw_field_key='c', unique=True, sparse=True)
+
+        names = sorted(index.document['name'] for index in Foo.index_models())
+        self.assertEqual(names, ['c_1', 'name_1', 'name_code'])
+
+        self.assertEqual(sorted(Foo.ensure_indexes()), ['c_1', 'name_1', 'name_code'])
+        indexes = db.foos.index_information()
+        self.assertTrue(indexes['c_1']['unique'])
+        self.assertEqual(indexes['name_code']['key'], [('name', 1), ('c', -1)])
+
+        # the existed indexes are skipped.
+        self.assertEqual(Foo.ensure_indexes(), [])
+
+    def test_search(self):
+        """Test search by the keys of `SearchField`."""
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+
+            _id = IDField()
+            name = StringField()
+            note = StringField()
+            search_keys = SearchField('name')
+
+        for i, name in enumerate([u'Joanne', u'Anna Lee', u'Leanne', u'Ｂｉｌｌ', u'王小明', u'Annie']):
+            Foo.create({'_id': 'id_%d' % i, 'name': name})
+
+        # prefix matches first, then substring matches, each by name.
+        self.assertEqual([foo.name for foo in Foo.search('ann')], [u'Anna Lee', u'Annie', u'Joanne', u'Leanne'])
+        self.assertEqual([foo.name for foo in Foo.search('LEE')], [u'Anna Lee'])
+        self.assertEqual([foo.name for foo in Foo.search('ann', limit=3)], [u'Anna Lee', u'Annie', u'Joanne'])
+        self.assertEqual([foo.name for foo in Foo.search(u'ＡＮＮ', limit=1)], [u'Anna Lee'])
+        self.assertEqual([foo.name for foo in Foo.search('bill')], [u'Ｂｉｌｌ'])
+        self.assertEqual([foo.name for foo in Foo.search(u'小明')], [u'王小明'])
+        self.assertEqual(Foo.search(' '), [])
+        self.assertNotIn('search_keys', Foo.search('bill')[0].to_jsonify())
+
+        # the keys are not loaded by default, and kept on save.
+        self.assertNotIn('search_keys', Foo.fetch({})[0]._attrs)
+        self.assertNotIn('search_keys', Foo.search('bill')[0]._attrs)
+        self.assertNotIn('search_keys', Foo.get_many(['id_0'])[0]._attrs)
+        self.assertIn('search_keys', Foo.get_one('id_0', fields=['search_keys'])._attrs)
+        foo = Foo.get_one('id_4')
+        self.assertNotIn('search_keys', foo._attrs)
+        foo.note = 'note'
+        foo.save()
+        self.assertIn(u'^王', db.foos.find_one({'_id': 'id_4'})['search_keys'])
+        foo.name = u'Mary'
+        foo.save(allow_fields=['name'])
+        self.assertEqual([foo.name for foo in Foo.search('mar')], [u'Mary'])
+        self.assertEqual(Foo.search(u'小明'), [])
+
+        # a term longer than the keys.
+        Foo.create({'_id': 'id_6', 'name': 'Annabelle Smithson'})
+        Foo.create({'_id': 'id_7', 'name': 'Annabelle Smith'})
+        self.assertEqual([foo.name for foo in Foo.search('annabelle smiths')], ['Annabelle Smithson'])
+        self.assertEqual([foo.name for foo in Foo.fetch(Foo.search_query('ANNABELLE  smiths'))], ['Annabelle Smithson'])
+        self.assertEqual(Foo.search_query('ann'), {'search_keys': u'ann'})
+
+        db.foos.insert_one({'_id': 'id_8', 'name': 'Annabelle Bach'})
+        result = Foo.backfill()
+        self.assertEqual(result.matched_count, 9)
+        self.assertEqual(Foo.search('bach', fields=['note'])[0].get_id(), 'id_8')
+
+    def test_upcoming(self):
+        """Test find the dates in next days by `DateField(month_day=True)`."""
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+
+            _id = IDField()
+            birthday = DateField(month_day=True)
+
+        self.assertIn('birthday_mmdd_1', [index.document['name'] for index in Foo.index_models()])
+
+        for i, date in enumerate(['1980-12-30', '1990-01-02', '2000-02-29', '1970-03-01', '1985-12-20']):
+            Foo.create({'_id': 'id_%d' % i, 'birthday': datetime.datetime.strptime(date, '%Y-%m-%d')})
+        Foo.create({'_id': 'id_none'})
+        self.assertEqual(db.foos.find_one({'_id': 'id_0'})['birthday_mmdd'], 1230)
+        self.assertIsNone(db.foos.find_one({'_id': 'id_none'})['birthday_mmdd'])
+        self.assertNotIn('birthday_mmdd', Foo.get_one('id_0').to_jsonify())
+
+        def upcoming(today, days):
+            return [foo.get_id() for foo in Foo.upcoming('birthday', days, today=today)]
+
+        # cross the end of year.
+        self.assertEqual(upcoming(datetime.date(2016, 12, 25), 14), ['id_0', 'id_1'])
+        self.assertEqual(upcoming(datetime.date(2017, 2, 27), 3), ['id_2', 'id_3'])
+        self.assertEqual(upcoming(datetime.date(2016, 12, 20), 1), ['id_4'])
+        self.assertEqual(len(upcoming(datetime.date(2016, 6, 1), 366)), 5)
+
+        foo = Foo.get_one('id_4')
+        foo.birthday = datetime.date(1985, 1, 1)
+        foo.save()
+        self.assertEqual(upcoming(datetime.date(2016, 12, 25), 14), ['id_0', 'id_4', 'id_1'])
+
+        db.foos.insert_one({'_id': 'id_5', 'birthday': datetime.datetime(1999, 12, 31)})
+        Foo.backfill()
+        self.assertEqual(upcoming(datetime.date(2016, 12, 25), 14), ['id_0', 'id_5', 'id_4', 'id_1'])
+
+        with self.assertRaises(ModelInvaldError):
+            Foo.upcoming('_id')
+
+    def test_aio(self):
+        """Test the queries in greenlets by `Model.aio`."""
+        import gevent
+        from flask import Flask
+        from app.models import aio
+        from app.models.identity import init_identity_map
+
+        class Foo(Base):
+            _table = ClassReadonlyProperty('foos')
+            _primary_key = ClassReadonlyProperty('_id')
+
+            _id = IDField()
+            name = StringField()
+
+        db.foos.insert_many([{'_id': 'id_%d' % i, 'name': 'name-%d' % i} for i in range(5)])
+
+        foo, foos, count = aio.gather(
+            Foo.aio.get_one('id_0'),
+            Foo.aio.get_many(['id_1', 'id_none']),
+            Foo.aio.count({}),
+        )
+        self.assertEqual(foo.name, 'name-0')
+        self.assertEqual(foos[0].name, 'name-1')
+        self.assertIsNone(foos[1])
+        self.assertEqual(count, 5)
+
+        result = Foo.aio.fetch({}, prefetch=2)
+        self.assertItemsEqual([row.name for row in result], ['name-%d' % i for i in range(5)])
+
+        # stop iterating early, the loading greenlet is killed instead of waiting forever.
+        result = Foo.aio.fetch({}, prefetch=1)
+        for row in result:
+            break
+        self.assertTrue(result._greenlet.dead)
+
+        # nothing is loaded if it is never iterated.
+        result = Foo.aio.fetch({}, prefetch=1)
+        gevent.sleep(0)
+        self.assertIsNone(result._greenlet)
+
+        foo.name = 'changed'
+        Foo.aio.save(foo).get()
+        self.assertEqual(db.foos.find_one({'_id': 'id_0'})['name'], 'changed')
+
+        with self.assertRaises(ModelInvaldError):
+            aio.gather(Foo.aio.get_one('id_0', fields=['unknown']))
+        with self.assertRaises(gevent.Timeout):
+            aio.gather(aio.spawn(gevent.sleep, 1), timeout=0.01)
+
+        # the greenlets share the identity map of the request.
+        app = Flask(__name__)
+        init_identity_map(app)
+        with app.test_request_context():
+            foo = Foo.get_one('id_1')
+            self.assertIs(Foo.aio.get_one('id_1').get(), foo)
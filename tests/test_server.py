@@ -3,6 +3,7 @@
 import os
 import sys
 import json
+import datetime
 import unittest
 import bson
 
@@ -24,6 +25,8 @@ class TestServer(unittest.TestCase):
     def tearDown(self):
         db.persons.delete_many({})
         db.groups.delete_many({})
+        Person._invalidate()
+        Group._invalidate()
 
     def test_person_create_update(self):
         """/person/create"""
@@ -56,6 +59,14 @@ class TestServer(unittest.TestCase):
         self.assertEqual(_person['phone_1'], post['phone_1'])
         self.assertEqual(_person['address_0'], post['address_0'])
 
+        post = {
+            'name': 'Bill-update',
+            'birthday': 'not a date'
+        }
+        r = self.client.post('/person/one/%s/update' % person_id, data=json.dumps(post), content_type='application/json')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(db.persons.find_one({'_id': person_id})['name'], 'Bill')
+
 
     def test_person_build_relation(self):
         """/person/<_id>/relation"""
@@ -82,6 +93,103 @@ class TestServer(unittest.TestCase):
         r = self.client.post('/person/id_0/relation', data=json.dumps(post), content_type='application/json')
         self.assertEqual(r.status_code, 400)
 
+    def test_person_overview(self):
+        """/person/<_id>/overview"""
+        db.groups.insert_many([{'_id': 'g_0', 'name': 'group-0'}, {'_id': 'g_1', 'name': 'group-1'}])
+        db.persons.insert_many([{
+            '_id': 'id_0',
+            'name': 'Bill',
+            'groups': ['g_0', 'g_1'],
+            'relations': [{'rel': 'family', 'person_id': 'id_1'}],
+        }, {
+            '_id': 'id_1',
+            'name': 'John',
+            'phone_0': '0988',
+        }])
+
+        r = self.client.get('/person/id_0/overview')
+        self.assertEqual(r.status_code, 200)
+        result = json.loads(r.data)['data']
+        self.assertEqual(result['person']['name'], 'Bill')
+        self.assertItemsEqual([group['name'] for group in result['groups']], ['group-0', 'group-1'])
+        self.assertEqual(result['relations'][0]['rel'], 'family')
+        self.assertItemsEqual(result['relations'][0]['person'].keys(), ['__class__', 'person_id', 'name'])
+
+        r = self.client.get('/person/id_none/overview')
+        self.assertEqual(r.status_code, 400)
+
+    def test_identity_map(self):
+        """Same instance in a request, and only the scheduled saves are flushed."""
+        db.persons.insert_many([{
+            '_id': 'id_0',
+            'name': 'Bill'
+        }, {
+            '_id': 'id_1',
+            'name': 'Mary'
+        }])
+        with self.main_app.test_request_context():
+            person = Person.get_one('id_0')
+            self.assertIs(person, Person.get_one('id_0'))
+            self.assertIs(person, Person.get_one(raw={'_id': 'id_0', 'name': 'Bill'}))
+            self.assertIsNot(person, Person.get_one('id_0', fields=['name']))
+            self.assertIs(person, Person.fetch({'_id': 'id_0'}).next())
+            self.assertIs(person, Person.get_many(['id_0'])[0])
+            person.name = 'John'
+            person.phone_0 = '0900'
+            person.save_later(allow_fields=['name'])
+            other = Person.get_one('id_1')
+            other.name = 'Tom'
+            self.main_app.process_response(self.main_app.response_class())
+        raw = db.persons.find_one({'_id': 'id_0'})
+        self.assertEqual(raw['name'], 'John')
+        self.assertNotIn('phone_0', raw)
+        self.assertEqual(db.persons.find_one({'_id': 'id_1'})['name'], 'Mary')
+        self.assertIsNot(Person.get_one('id_0'), Person.get_one('id_0'))
+
+        # a read never writes.
+        r = self.client.get('/person/id_0/overview')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(db.persons.find_one({'_id': 'id_0'}), raw)
+
+    def test_person_graph(self):
+        """/person/<_id>/graph"""
+        db.persons.insert_many([{
+            '_id': 'id_0',
+            'name': 'Bill',
+            'relations': [{'rel': 'parent', 'person_id': 'id_1'}]
+        }, {
+            '_id': 'id_1',
+            'name': 'John',
+            'relations': [{'rel': 'child', 'person_id': 'id_0'}, {'rel': 'parent', 'person_id': 'id_2'}]
+        }, {
+            '_id': 'id_2',
+            'name': 'Mary',
+            'relations': [{'rel': 'child', 'person_id': 'id_1'}]
+        }])
+        r = self.client.get('/person/id_0/graph?depth=1')
+        self.assertEqual(r.status_code, 200)
+        result = json.loads(r.data)['data']
+        self.assertEqual([node['person_id'] for node in result['nodes']], ['id_0', 'id_1'])
+        self.assertIn({'from': 'id_0', 'to': 'id_1', 'rel': 'parent'}, result['edges'])
+
+        r = self.client.get('/person/id_0/graph?depth=2')
+        result = json.loads(r.data)['data']
+        self.assertEqual([node['depth'] for node in result['nodes']], [0, 1, 2])
+        self.assertFalse(result['truncated'])
+        self.assertEqual(len(result['edges']), 4)
+
+        r = self.client.get('/person/id_0/graph?depth=2&max_nodes=1')
+        result = json.loads(r.data)['data']
+        self.assertEqual(len(result['nodes']), 2)
+        self.assertTrue(result['truncated'])
+
+        # the whole network fits, and a missing person is skipped.
+        db.persons.update_one({'_id': 'id_2'}, {'$push': {'relations': {'rel': 'child', 'person_id': 'id_none'}}})
+        r = self.client.get('/person/id_0/graph?depth=3&max_nodes=2')
+        result = json.loads(r.data)['data']
+        self.assertEqual([node['person_id'] for node in result['nodes']], ['id_0', 'id_1', 'id_2'])
+        self.assertFalse(result['truncated'])
+
     def test_person_list(self):
         """/person/list"""
         db.persons.insert_many([{
@@ -94,6 +202,7 @@ class TestServer(unittest.TestCase):
             '_id': 'id_3',
             'name': 'Mary',
         }])
+        Person.backfill()
 
         r = self.client.get('/person/list')
         self.assertEqual(r.status_code, 200)
@@ -112,6 +221,97 @@ class TestServer(unittest.TestCase):
         result = json.loads(r.data)['data']
         self.assertEqual(result[0]['name'], 'John')
 
+        # a term longer than the keys is filtered by the whole term.
+        db.persons.insert_many([{'_id': 'id_4', 'name': 'Annabelle Smithson'}, {'_id': 'id_5', 'name': 'Annabelle Jones'}])
+        Person.backfill()
+        r = self.client.get('/person/list?term=annabelle%20smiths')
+        self.assertEqual([row['name'] for row in json.loads(r.data)['data']], ['Annabelle Smithson'])
+        db.persons.delete_many({'_id': {'$in': ['id_4', 'id_5']}})
+
+        r = self.client.get('/person/search?term=AR&limit=5')
+        self.assertEqual(r.status_code, 200)
+        result = json.loads(r.data)['data']
+        self.assertEqual([row['name'] for row in result], ['Mary'])
+
+        r = self.client.get('/person/list?fields=name')
+        self.assertEqual(r.status_code, 200)
+        result = json.loads(r.data)['data']
+        self.assertEqual(len(result), 3)
+        for row in result:
+            self.assertItemsEqual(row.keys(), ['__class__', 'person_id', 'name'])
+
+        r = self.client.get('/person/list?fields=unknown')
+        self.assertEqual(r.status_code, 400)
+
+        r = self.client.get('/person/list?page_size=2&sort=name&with_total=1')
+        result = json.loads(r.data)
+        self.assertEqual([row['name'] for row in result['data']], ['Bill', 'John'])
+        self.assertEqual(result['total'], 3)
+        r = self.client.get('/person/list?page_size=2&page_token=%s' % result['next_page_token'])
+        result = json.loads(r.data)
+        self.assertEqual([row['name'] for row in result['data']], ['Mary'])
+        self.assertIsNone(result['next_page_token'])
+
+    def test_stats(self):
+        """/stats/<name>"""
+        today = datetime.date.today()
+        db.persons.insert_many([{
+            '_id': 'id_1',
+            'name': 'Bill',
+            'gender': 'male',
+            'birthday': datetime.datetime(today.year - 35, 1, 1),
+            'register_date': datetime.datetime(2015, 3, 1),
+            'baptize_date': datetime.datetime(2015, 5, 1),
+            'baptize_priest': 'Paul',
+        }, {
+            '_id': 'id_2',
+            'name': 'Mary',
+            'gender': 'female',
+            'birthday': datetime.datetime(today.year - 5, 1, 1),
+            'register_date': datetime.datetime(2016, 3, 1),
+        }, {
+            '_id': 'id_3',
+            'name': 'John',
+            'gender': 'male',
+            'register_date': datetime.datetime(2016, 4, 1),
+            'baptize_date': datetime.datetime(2016, 5, 1),
+            'baptize_priest': 'Paul',
+        }])
+
+        def get(name):
+            r = self.client.get('/stats/%s' % name)
+            self.assertEqual(r.status_code, 200)
+            return {row['key']: row['count'] for row in json.loads(r.data)['data']}
+
+        self.assertEqual(get('gender'), {'male': 2, 'female': 1})
+        self.assertEqual(get('register_year'), {2015: 1, 2016: 2})
+        self.assertEqual(get('baptize_priest'), {'Paul': 2})
+        self.assertEqual(get('age'), {'30-44': 1, '0-11': 1, 'unknown': 1})
+        self.assertEqual(db.stats_cache.find_one({'_id': 'gender'})['data'][0], {'key': 'female', 'count': 1})
+
+        # cached until write by model.
+        db.persons.insert_one({'_id': 'id_4', 'gender': 'female'})
+        self.assertEqual(get('gender'), {'male': 2, 'female': 1})
+        Person.create({'person_id': 'id_5', 'gender': 'female'})
+        self.assertEqual(get('gender'), {'male': 2, 'female': 3})
+
+        r = self.client.get('/stats/unknown')
+        self.assertEqual(r.status_code, 400)
+
+    def test_person_upcoming(self):
+        """/person/upcoming"""
+        today = datetime.date.today()
+        Person.create({'person_id': 'id_1', 'name': 'Bill', 'birthday': datetime.date(2000, today.month, today.day)})
+        Person.create({'person_id': 'id_2', 'name': 'Mary', 'birthday': today + datetime.timedelta(days=60)})
+
+        r = self.client.get('/person/upcoming?field=birthday&days=7&fields=name')
+        self.assertEqual(r.status_code, 200)
+        result = json.loads(r.data)['data']
+        self.assertEqual([row['name'] for row in result], ['Bill'])
+
+        r = self.client.get('/person/upcoming?field=name')
+        self.assertEqual(r.status_code, 400)
+
     def test_person_one(self):
         """/person/one/<_id>"""
         db.persons.insert_many([{
@@ -173,3 +373,30 @@ class TestServer(unittest.TestCase):
         r = self.client.get('/group/one/id_1')
         result = json.loads(r.data)['data']
         self.assertEqual(result['name'], 'group-1')
+
+        db.persons.insert_many([
+            {'_id': 'p_0', 'name': 'Bill', 'groups': ['id_0', 'id_1']},
+            {'_id': 'p_1', 'name': 'John', 'groups': ['id_0']},
+            {'_id': 'p_2', 'name': 'Mary', 'groups': ['id_0']},
+        ])
+        r = self.client.get('/group/list?with_counts=1')
+        result = json.loads(r.data)['data']
+        self.assertEqual({row['group_id']: row['member_count'] for row in result}, {'id_0': 3, 'id_1': 1})
+        self.assertEqual(Group.member_counts(['id_1']), {'id_1': 1})
+
+        Person.backfill()
+        r = self.client.get('/person/list?group=id_0&term=o')
+        result = json.loads(r.data)['data']
+        self.assertEqual([row['name'] for row in result], ['John'])
+        r = self.client.get('/person/list?group=id_0&page_size=2&sort=name')
+        result = json.loads(r.data)
+        self.assertEqual([row['name'] for row in result['data']], ['Bill', 'John'])
+        r = self.client.get('/person/list?group=id_0&page_token=%s' % result['next_page_token'])
+        result = json.loads(r.data)
+        self.assertEqual([row['name'] for row in result['data']], ['Mary'])
+
+        r = self.client.get('/group/list?format=ndjson')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in r.data.splitlines()]
+        self.assertItemsEqual([row['group_id'] for row in rows], ['id_0', 'id_1'])